@@ -1,28 +1,73 @@
-from llmproxy import generate
-from utils.uploads import handbook_upload
+from llmproxy import generate, generate_stream, rag_context_string_simple
+from utils.handbook_index import get_corpus
+from utils.rag_profiles import rag_profile_classifier
+from utils.history import replay_window
 from prompt import get_system_prompt, get_escalated_response
-import time
+from utils.metrics import timed
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# how long a request may wait for a corpus that is about to be ready
+CORPUS_WAIT_SECONDS = float(os.environ.get("CORPUS_WAIT_SECONDS", "3"))
+
+# appended instead of handbook context while the shared corpus is still indexing
+INDEXING_NOTICE = """
+NOTE: The handbooks are still being indexed and no handbook excerpts are available for this message.
+Do not cite or quote handbook policies from memory. For questions that need the handbooks, let the student know
+the handbooks are still loading and suggest asking again in a minute or talking to a human advisor.
+"""
 
 class TuftsCSAdvisor:
+    @timed("advisor.init")
     def __init__(self, user_profile):
         self.user_profile = user_profile
         self.user_id = user_profile["user_id"]
-        self.last_k = user_profile["last_k"]
-        if user_profile["last_k"] == 0:
-            handbook_upload(self.user_id)
-            time.sleep(2)
+        # replay a bounded window of recent turns; older ones are summarized in the prompt
+        self.last_k = replay_window(user_profile)
+
+        # handbooks live in one shared corpus (LLMProxy session or local index,
+        # per RAG_MODE) prepared in the background; only wait for it when it is
+        # about to be ready, never while uploading or after a failed run
+        self.corpus = get_corpus()
+        self.corpus.start_ingestion()
+        self.corpus_ready = self.corpus.is_ready()
+        if not self.corpus_ready and self.corpus.nearly_ready():
+            self.corpus_ready = self.corpus.wait_until_ready(CORPUS_WAIT_SECONDS)
+        self.corpus_session = self.corpus.session_id
+
+    def get_handbook_context(self, query, rag_threshold=None, rag_k=None):
+        """
+        Retrieve handbook chunks for the query from the shared corpus.
+
+        Unless given, rag_threshold and rag_k come from the query's local RAG
+        profile: narrow policy questions retrieve fewer, closer chunks.
+        """
+        if not self.corpus_ready:
+            return INDEXING_NOTICE
+
+        if rag_threshold is None or rag_k is None:
+            params = rag_profile_classifier.params(query)
+            rag_threshold = params["rag_threshold"] if rag_threshold is None else rag_threshold
+            rag_k = params["rag_k"] if rag_k is None else rag_k
+
+        rag_context = self.corpus.retrieve(query, rag_threshold=rag_threshold, rag_k=rag_k)
+        if isinstance(rag_context, list):
+            return rag_context_string_simple(rag_context)
+
+        logger.warning("Handbook retrieval failed: %s", rag_context)
+        return ""
 
     def get_escalated_response(self, query):
         rag_response = generate(
             model='4o-mini',
-            system=get_escalated_response(self.user_profile),
+            system=get_escalated_response(self.user_profile) + self.get_handbook_context(query),
             query=query,
             temperature=0.1,
             lastk=0,
             session_id='cs-advising-handbooks-v5-' + self.user_id,      # prev v5
-            rag_usage=True,
-            rag_threshold=0.5,  # Lower threshold
-            rag_k=5  # Retrieve more documents
+            rag_usage=False
         )
 
         if isinstance(rag_response, dict) and 'response' in rag_response:
@@ -32,25 +77,40 @@ class TuftsCSAdvisor:
 
 
     def get_faq_response(self, faq_formatted, query):
-        print(f"user {self.user_id} has lastk {self.last_k}")
-        print("user_profile: ", self.user_profile)
+        logger.debug("user %s has lastk %s", self.user_id, self.last_k)
+        logger.debug("user_profile: %s", self.user_profile)
+
+        handbook_context = self.get_handbook_context(query)
 
         rag_response = generate(
             model='4o-mini',
-            system=get_system_prompt(self.user_profile),
+            system=get_system_prompt(self.user_profile) + handbook_context,
             query=query,
             temperature=0.1,
             lastk=self.last_k,
             session_id='cs-advising-handbooks-v5-' + self.user_id,      # prev v5
-            rag_usage=True,
-            rag_threshold=0.5,  # Lower threshold
-            rag_k=5  # Retrieve more documents
+            rag_usage=False
         )
 
-        print("\nResponse:", rag_response.get('response') if isinstance(rag_response, dict) else rag_response)
-        print("\nRAG Context:", rag_response.get('rag_context') if isinstance(rag_response, dict) else "No context available")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response: %s", rag_response.get('response') if isinstance(rag_response, dict) else rag_response)
+            logger.debug("RAG Context: %s", handbook_context or "No context available")
 
         if isinstance(rag_response, dict) and 'response' in rag_response:
             return rag_response['response']
         
-        return rag_response
\ No newline at end of file
+        return rag_response
+
+    def stream_faq_response(self, query):
+        """
+        Same request as get_faq_response, but yields the raw reply as it is generated.
+        """
+        yield from generate_stream(
+            model='4o-mini',
+            system=get_system_prompt(self.user_profile) + self.get_handbook_context(query),
+            query=query,
+            temperature=0.1,
+            lastk=self.last_k,
+            session_id='cs-advising-handbooks-v5-' + self.user_id,
+            rag_usage=False
+        )
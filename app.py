@@ -1,37 +1,86 @@
 # Standard library imports
 import os
+import csv
 import json
 import logging
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party imports
-import requests
 from bson.objectid import ObjectId
-from flask import Flask, request, jsonify, redirect, render_template
+from pymongo import ReturnDocument
+from flask import Flask, Response, request, jsonify, redirect, render_template, stream_with_context
 
 # Local application imports
 from advisor import TuftsCSAdvisor
+from llmproxy import get_pool_stats
+from prompt import invalidate_student_prompt, get_greeting_response, get_farewell_response
+from utils.rocketchat import get_rocketchat_client
 from utils.mongo_config import get_collection, get_mongodb_connection
-from utils.log_config import setup_logging
-from utils.emails import send_notification_email
+from utils.indexes import ensure_indexes
+from utils.log_config import setup_logging, get_logging_stats
+from utils.emails import send_notification_email, get_email_queue
+from utils.task_queue import KeyedWorkQueue, QueueFullError
+from utils.cache import LRUCache
+from utils.handbook_index import get_corpus
+from utils.response_cache import response_cache
+from utils.faq_matcher import faq_matcher
+from utils.rag_profiles import rag_profile_classifier
+from utils.intent_router import intent_router
+from utils.history import history_manager
+from utils.faq_store import (PAGE_SIZE, list_faqs, count_faqs, next_question_id, peek_next_question_id, reserve_question_ids,
+                             import_faqs, export_faqs, find_faqs_by_question_id)
+from utils.streaming import ProgressiveMessageUpdater
+from utils.llm_json import IncrementalReplyParser, parse_llm_reply
+from utils import metrics
+from utils.metrics import timed, timed_query, stage_timer, set_query_labels
 
 app = Flask(__name__)
+metrics.init_app(app)
 
 # log
 setup_logging()
 logger = logging.getLogger(__name__)
 
 # global variables
-RC_BASE_URL = "https://chat.genaiconnect.net/api/v1"
+rocketchat = get_rocketchat_client()
 
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-Auth-Token": os.environ.get("RC_token"),
-    "X-User-Id": os.environ.get("RC_userId")
-}
+# start preparing the shared handbook corpus (proxy upload or local index) before the first question arrives
+get_corpus().start_ingestion()
+
+# make sure the lookups in /query are index-backed
+ensure_indexes()
 
 HUMAN_OPERATOR = "@wendan.jiang" 
 
+# stream LLM output into the loading message (requires a streaming-capable proxy)
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "false").lower() == "true"
+
+# transcript of a newly created profile
+DEFAULT_TRANSCRIPT = {
+    "program": "",
+    "completed_courses": [],
+    "credits_earned": "",
+    "GPA": "",
+    "domestic": ""
+}
+
+# also email the advisor on every new escalation
+ESCALATION_EMAIL = os.environ.get("ESCALATION_EMAIL", "false").lower() == "true"
+
+# small pool for database writes that can overlap with RocketChat/LLM calls
+background = ThreadPoolExecutor(max_workers=int(os.environ.get("BACKGROUND_WORKERS", "8")), thread_name_prefix="background")
+
+# thread mappings never change once written, so the thread lookup can skip Mongo
+thread_cache = LRUCache(maxsize=int(os.environ.get("THREAD_CACHE_SIZE", "4096")))
+
+# async mode: acknowledge the webhook right away and answer from a worker pool
+ASYNC_QUERY = os.environ.get("ASYNC_QUERY", "false").lower() == "true"
+query_queue = KeyedWorkQueue(
+    max_workers=int(os.environ.get("QUERY_WORKERS", "8")),
+    max_pending=int(os.environ.get("QUERY_MAX_PENDING", "500")),
+    name="query"
+)
+
 def is_json_object(json_string):
     try:
         parsed = json.loads(json_string)
@@ -41,13 +90,14 @@ def is_json_object(json_string):
     except json.JSONDecodeError:
         return None
 
-def send_to_human(user, original_question, llm_answer=None, tmid=None, trigger_msg_id=None, uncertain_areas=None):
+def build_human_payload(user, original_question, llm_answer=None, tmid=None, trigger_msg_id=None, uncertain_areas=None):
     """
-    Sends a message to a human operator via RocketChat when AI escalation is needed.
+    Builds the chat.postMessage payload for a message sent to the human operator.
 
-    This function handles two scenarios:
+    This function handles three scenarios:
     1. Initial escalation: Creates a new message in the human operator channel with alert emoji
-    2. Thread continuation: Forwards subsequent user messages to an existing thread
+    2. AI answer: Starts a thread on the initial escalation message with the AI-generated answer
+    3. Thread continuation: Forwards subsequent user messages to an existing thread
     """
 
     # initial message sent to human advisor (without thread created)
@@ -100,12 +150,23 @@ def send_to_human(user, original_question, llm_answer=None, tmid=None, trigger_m
             "text": f"🐘 *{user} (student):* {original_question}",
             "tmid": tmid
         }
-        logger.info("forwarding to thread: " + tmid)
+        logger.info("forwarding to thread: %s", tmid)
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
+    return payload
+
+def send_to_human(user, original_question, llm_answer=None, tmid=None, trigger_msg_id=None, uncertain_areas=None):
+    """
+    Sends a message to a human operator via RocketChat when AI escalation is needed.
+
+    This function handles two scenarios:
+    1. Initial escalation: Creates a new message in the human operator channel with alert emoji
+    2. Thread continuation: Forwards subsequent user messages to an existing thread
+    """
+    payload = build_human_payload(user, original_question, llm_answer, tmid, trigger_msg_id, uncertain_areas)
+    response = rocketchat.post_message(payload)
 
     logger.info("successfully forward message to human")
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    logger.debug("RocketChat API Response: %s - %s", response.status_code, response.text)
     return response.json()
 
 def send_human_response(room_id, message, tmid):
@@ -118,8 +179,8 @@ def send_human_response(room_id, message, tmid):
         "tmid": tmid
     }
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    response = rocketchat.post_message(payload)
+    logger.debug("RocketChat API Response: %s - %s", response.status_code, response.text)
     return response.json()
 
 def send_loading_response(room_id, loading_msg=" :everything_fine_parrot: Processing your inquiry. One moment please..."):
@@ -128,8 +189,8 @@ def send_loading_response(room_id, loading_msg=" :everything_fine_parrot: Proces
         "text": loading_msg
     }
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    response = rocketchat.post_message(payload)
+    logger.debug("RocketChat API Response: %s - %s", response.status_code, response.text)
 
     if response.status_code == 200:
         json_res = response.json()
@@ -138,13 +199,7 @@ def send_loading_response(room_id, loading_msg=" :everything_fine_parrot: Proces
         raise Exception("fail to send loading message")
     
 def update_loading_message(room_id, loading_msg_id, text=" :kirby_hi: Ta-da! Your answer is ready!"):
-    requests.post(f"{RC_BASE_URL}/chat.update",
-                  json={
-                      "roomId": room_id,
-                      "msgId": loading_msg_id,
-                      "text": text
-                  },
-                  headers=HEADERS)
+    rocketchat.update_message(room_id, loading_msg_id, text)
 
 def format_response_with_buttons(response_text, suggested_questions, category_id):
     question_buttons = []
@@ -232,14 +287,72 @@ def format_summary_confirmation(original_question):
         ]
     }
 
-def build_bidirectional_threads(user, original_question, llm_answer, message_id, uncertain_areas):
-    # Forward to human advisor and get the response
-    forward_res = send_to_human(user, original_question)
+@timed("mongo.profile_upsert")
+def fetch_profile(user_collection, user_id, user_name, question=None):
+    """
+    Load a student's profile, creating it on first contact, in a single
+    atomic find_one_and_update. A given `question` is recorded as
+    last_question in the same write.
 
+    last_k is not touched here; count_llm_turn is its only writer.
+    """
+    fields = {
+        "username": {"$ifNull": ["$username", user_name]},
+        "transcript": {"$ifNull": ["$transcript", {"$literal": DEFAULT_TRANSCRIPT}]}
+    }
+    if question is not None:
+        fields["last_question"] = {"$literal": question}
+    return user_collection.find_one_and_update(
+        {"user_id": user_id},
+        [{"$set": fields}],
+        # recent_turns is only read by the history summarizer
+        projection={"recent_turns": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+@timed("mongo.count_turn")
+def count_llm_turn(user_collection, user_id, user_profile):
+    """
+    Add one to last_k for a message that is about to reach the LLM session.
+
+    Cache, FAQ and routed answers never enter the session, so only this path
+    counts; otherwise last_k would run ahead of the turns the LLM holds and
+    the replay window and history turn numbers would drift. The increment is
+    atomic, so concurrent messages from one student still get distinct turns,
+    and it is skipped while an escalation is pending, since escalation replies
+    do not count as advising turns. user_profile keeps the value from *before*
+    this message, which is what the advisor replays as history.
+    """
+    updated = user_collection.find_one_and_update(
+        {"user_id": user_id, "pending_escalation": {"$ne": True}},
+        {"$inc": {"last_k": 1}},
+        projection={"last_k": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is not None:
+        user_profile["last_k"] = updated["last_k"] - 1
+
+def set_pending_escalation(user_collection, user_id):
+    user_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {"pending_escalation": True}}  # Set pending_escalation to True
+    )
+
+@timed("escalation.build_threads")
+def build_bidirectional_threads(user, original_question, llm_answer, message_id, uncertain_areas,
+                               room_id=None, loading_msg_id=None, loading_text=None):
+    """
+    Escalates a question to the human advisor.
+
+    Only the AI-answer thread message depends on the alert (it needs its _id),
+    so once the alert is posted the thread message, the thread mapping write,
+    the student's loading update and the optional email all run concurrently:
+    the student waits roughly two RocketChat round trips.
+    """
     # message_id starts a new thread on human advisor side
-    # send a thread message that contains AI-generated response
+    forward_res = send_to_human(user, original_question)
     advisor_messsage_id = forward_res["message"]["_id"]
-    send_to_human(user, original_question, llm_answer, trigger_msg_id=advisor_messsage_id, uncertain_areas=uncertain_areas)
 
     # Create bidirectional thread mapping for ongoing conversation
     thread_item = [{
@@ -254,19 +367,84 @@ def build_bidirectional_threads(user, original_question, llm_answer, message_id,
         "forward_username": user
 
     }]
+
+    steps = [
+        # send a thread message that contains AI-generated response
+        background.submit(send_to_human, user, original_question, llm_answer,
+                          trigger_msg_id=advisor_messsage_id, uncertain_areas=uncertain_areas),
+        background.submit(store_thread_mapping, thread_item)
+    ]
+    if loading_msg_id:
+        steps.append(background.submit(update_loading_message, room_id, loading_msg_id, loading_text))
+    if ESCALATION_EMAIL:
+        # nobody waits on the email
+        background.submit(send_notification_email, user, original_question, llm_answer, True)
+
+    # surface the first failure only after every step has had its chance to finish
+    errors = []
+    for step in steps:
+        try:
+            step.result()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def store_thread_mapping(thread_item):
+    """
+    Insert both directions of a thread mapping, caching them only once they are stored.
+    """
     thread_collection = get_collection("Users", "threads")
-    thread_collection.insert_many(thread_item)
+    # insert_many adds an _id to the documents it is given; keep the cached copies clean
+    thread_collection.insert_many([dict(item) for item in thread_item])
+    for item in thread_item:
+        thread_cache.set(item["thread_id"], item)
 
 
-@app.route('/query', methods=['POST'])
-def main():
+def load_thread_mapping(thread_id):
     """
-    Main endpoint for handling user queries to the Tufts CS Advisor.
+    Return the bidirectional mapping for a thread, from thread_cache when it
+    is there, otherwise read from Mongo and cached.
     """
-    data = request.get_json() 
+    mapping = thread_cache.get(thread_id)
+    if mapping is None:
+        mapping = find_thread_mapping(thread_id)
+        if mapping:
+            thread_cache.set(thread_id, mapping)
+    return mapping
+
+
+@timed("mongo.thread_lookup")
+def find_thread_mapping(thread_id):
+    thread_collection = get_collection("Users", "threads")
+    return thread_collection.find_one({"thread_id": thread_id}, {"_id": 0})
+
+
+def forward_thread_message(target_thread, user, message, channel_id):
+    # Determine message direction (student to human advisor or vice versa)
+    forward_human = target_thread.get("forward_human")
+    if forward_human == True:
+        forward_thread_id = target_thread.get("forward_thread_id")
+        logger.info("forwarding a message from student to human advisor (forward_thread_id %s)", forward_thread_id)
+        send_to_human(user, message, tmid=forward_thread_id)
+    else:
+        # forward_username = target_thread.get("forward_username")
+        forward_thread_id = target_thread.get("forward_thread_id")
+        send_human_response(channel_id, message, forward_thread_id)
 
-    logger.info("add a debug line to verify if the code is modified or not")
 
+@timed_query
+def handle_query(data):
+    """
+    Processes one RocketChat webhook message for the Tufts CS Advisor.
+
+    Args:
+        data (dict): webhook payload sent by RocketChat
+
+    Returns:
+        tuple: (response body dict, HTTP status code)
+    """
     # Extract relevant information
     user_id = data.get("user_id")
     user_name = data.get("user_name", "Unknown")
@@ -277,12 +455,12 @@ def main():
     channel_id = data.get("channel_id")
 
     # Log the incoming request
-    logger.info("hit /query endpoint, request data: %s", json.dumps(data, indent=2))
-    logger.info(f"{user_name} : {message}")
+    logger.debug("hit /query endpoint", extra={"request": data})
+    logger.info("%s : %s", user_name, message)
 
     # Ignore bot messages
     if data.get("bot") or not message:
-        return jsonify({"status": "ignored"})
+        return {"status": "ignored"}, 200
     
     # Handle button message
     # parsed_msg = is_json_object(message)
@@ -311,20 +489,35 @@ def main():
         # Get MongoDB client from the connection pool
         mongo_client = get_mongodb_connection()
         if not mongo_client:
-            return jsonify({"text": "Error connecting to database"}), 500
+            return {"text": "Error connecting to database"}, 500
         
+        # ==== LOCAL PRE-ROUTING ====
+        # button payloads, handoff requests, greetings and thank-yous have canned
+        # replies; recognize them before any LLM work is started
+        route = intent_router.route(message) if not tmid else None
+
+        # ==== USER PROFILE MANAGEMENT ====
+        # Get or create the profile and remember the question in one round trip.
+        # last_k is not bumped here: only messages that reach the LLM session
+        # count as turns, and that is only known after the cache and FAQ misses
         user_collection = get_collection("Users", "user")
-        user_profile = user_collection.find_one({"user_id": user_id})
+        if tmid:
+            # thread messages (advisor replies included) only need the pending
+            # check below and must never create a profile
+            user_profile = user_collection.find_one({"user_id": user_id}, {"recent_turns": 0})
+        else:
+            question = message if route is None else None
+            user_profile = fetch_profile(user_collection, user_id, user_name, question)
         
         # === QUESTION SUMMARY HANDLING ===
         if user_profile and user_profile.get("pending_escalation") is True:
+            set_query_labels(category_id="4", path="escalation")
             _, loading_msg_id = send_loading_response(channel_id, loading_msg=" :everything_fine_parrot: Forwarding your request to a human advisor now...")
 
             advisor = TuftsCSAdvisor(user_profile)
             response_data = advisor.get_escalated_response(message)
-            print("LINE 325")
-            print(response_data)
-            response_data = json.loads(response_data)
+            logger.debug("escalation reply: %s", response_data)
+            response_data = parse_llm_reply(response_data)
 
             llm_answer = response_data.get("llmAnswer")
             uncertain_areas = response_data.get("uncertainAreas")
@@ -336,141 +529,147 @@ def main():
                     {"$set": {"pending_escalation": False}}  # Set pending_escalation to True
                 )
                 update_loading_message(channel_id, loading_msg_id, "error processing your escalation request to human advisors, please try again")
-                return jsonify({"success": True}), 200
+                return {"success": True}, 200
 
-            # Forward to human advisor and get the response
-            build_bidirectional_threads(user_name, message, llm_answer, message_id, uncertain_areas)
-
-            # flip pending_escalation back to false
-            user_collection.update_one(
+            # flip pending_escalation back to false while the escalation is posted
+            reset_pending = background.submit(
+                user_collection.update_one,
                 {"user_id": user_id},
-                {"$set": {"pending_escalation": False}}  # Set pending_escalation to True
+                {"$set": {"pending_escalation": False}}
+            )
+
+            # Forward to human advisor and get the response
+            build_bidirectional_threads(
+                user_name, message, llm_answer, message_id, uncertain_areas,
+                room_id=channel_id, loading_msg_id=loading_msg_id,
+                loading_text=" :coll_doge_gif: Successfully forwarded your question to a human advisor. \n📬 To begin your conversation with a human advisor, please click the \"**View Thread**\" button."
             )
-            update_loading_message(channel_id, loading_msg_id, " :coll_doge_gif: Successfully forwarded your question to a human advisor. \n📬 To begin your conversation with a human advisor, please click the \"**View Thread**\" button.")
-            return jsonify({
+            reset_pending.result()
+            return {
                 "text": "Connecting you with a human advisor now — their response will appear just below once it's ready!",
                 "tmid": message_id
-            })
+            }, 200
         
         # ==== THREAD MESSAGE HANDLING ====
         # If message is part of an existing thread, handle direct forwarding without LLM processing
         if tmid:
             logger.info("Processing thread message - direct forwarding without LLM processing")
-            thread_collection = get_collection("Users", "threads")
-            target_thread = thread_collection.find_one({"thread_id": tmid})
+            set_query_labels(path="thread")
+            target_thread = load_thread_mapping(tmid)
 
             if not target_thread:
                 logger.error("thread with id %s does not exist", tmid)
-                return jsonify({"text": f"Error: unable to find a matched thread"}), 500
-            
-            # Determine message direction (student to human advisor or vice versa)
-            forward_human = target_thread.get("forward_human")
-            if forward_human == True:
-                forward_thread_id = target_thread.get("forward_thread_id")
-                logger.info("forwarding a message from student to human advisor (forward_thread_id " + forward_thread_id + ")")
-                send_to_human(user, message, tmid=forward_thread_id)
-            else:
-                # forward_username = target_thread.get("forward_username")
-                forward_thread_id = target_thread.get("forward_thread_id")
-                send_human_response(channel_id, message, forward_thread_id)
+                return {"text": f"Error: unable to find a matched thread"}, 500
             
-            return jsonify({"success": True}), 200
+            forward_thread_message(target_thread, user, message, channel_id)
+            return {"success": True}, 200
     
-        # ==== USER PROFILE MANAGEMENT ====
-        # Get or create user profile for tracking interactions
-        if not user_profile:
-            user_profile = {
-                "user_id": user_id,
-                "username": user_name,
-                "last_k": 0,
-                "transcript": {
-                    "program": "",
-                    "completed_courses": [],
-                    "credits_earned": "",
-                    "GPA": "",
-                    "domestic": ""
-                }
-            }
-            user_collection.insert_one(user_profile)
-
-        # Update the interaction counter for this user
-        lastk = user_profile.get("last_k", 0)
-        user_collection.update_one(
-                {"user_id": user_id},
-                {"$set": {"last_k": lastk + 1}}
-            )
+        # ==== ROUTED INTENTS ====
+        if route:
+            set_query_labels(category_id=route["category_id"], path="router")
+            logger.info("Routed locally as %s (%s) - skipping LLM", route["intent"], route["source"])
+            if route["intent"] == "handoff":
+                # confirm the last question the student asked; they can still edit it
+                original_question = user_profile.get("last_question") or message
+                set_pending_escalation(user_collection, user_id)
+                return format_summary_confirmation(original_question), 200
+            if route["intent"] == "greeting":
+                return format_response_with_buttons(get_greeting_response(user_profile), None, "1"), 200
+            return format_response_with_buttons(get_farewell_response(), None, "7"), 200
+
+        # ==== RESPONSE CACHE ====
+        # Repeated questions (same normalized text, same personalization-relevant
+        # profile, same handbook corpus) are answered without an LLM round trip;
+        # follow-ups that lean on the student's earlier turns always miss
+        corpus_version = get_corpus().session_id
+        with stage_timer("response_cache"):
+            cached = response_cache.get(message, user_profile, corpus_version)
+        if cached:
+            set_query_labels(category_id=cached["category_id"], path="response_cache")
+            logger.info("Found cached response for normalized question - skipping LLM")
+            return format_response_with_buttons(cached["response"], cached.get("suggestedQuestions"), cached["category_id"]), 200
 
-        # Initialize the advisor with user profile data
-        advisor = TuftsCSAdvisor(user_profile)
-
-        # ==== FAQ MATCHING - EXACT MATCH ====
-        # Check if question exactly matches a cached question in the database
-        # faq_collection = get_collection("freq_questions", "questions")
-        # faq_doc = faq_collection.find_one({"question": message})
-        # if faq_doc:
-        #     logger.info("Found exact FAQ match - returning cached response")
-        #     return jsonify(format_response_with_buttons(faq_doc["answer"], faq_doc["suggestedQuestions"]))
-        
         # ==== FAQ MATCHING - SEMANTIC MATCH ====
-        # If no exact match, try semantic matching with all FAQs
-        # else:
+        # One vectorized cosine lookup against the locally indexed FAQ bank
+        with stage_timer("faq_match"):
+            faq_answer, score = faq_matcher.match(message)
+        if faq_answer:
+            set_query_labels(category_id="2", path="faq")
+            logger.info("Found semantic FAQ match %s with confidence score %.3f - returning cached response", faq_answer['question_id'], score)
+            return format_response_with_buttons(faq_answer["answer"], faq_answer["suggestedQuestions"], "2"), 200
+
+        # this message goes to the LLM session: count the turn while the loading message is sent
+        turn_counted = background.submit(count_llm_turn, user_collection, user_id, user_profile)
 
         # Prompting loading message
         room_id, loading_msg_id = send_loading_response(channel_id)
+        turn_counted.result()
 
-        # faq_cursor = faq_collection.find(
-        #     {"question": {"$exists": True}},  
-        #     {"_id": 0, "question": 1, "question_id": 1}  # Projection to only return these fields
-        # )
-
-        # faq_list = []
-        # for doc in faq_cursor:
-        #     faq_list.append(f"{doc['question_id']}: {doc['question']}")
-        # faq_string = "\n".join(faq_list)
-        # response_data = json.loads(advisor.get_cached_response(faq_string, message))
-
-        # Check if LLM found a semantically similar FAQ
-        # if response_data.get("cached_question_id"):
-        #     faq_answer = faq_collection.find_one({"question_id": int(response_data["cached_question_id"])})
-        #     logger.info(f"Found semantic FAQ match with confidence score {response_data["confidence"]} - returning cached response")
-
-        #     response_data = {
-        #         "response": faq_answer["answer"],
-        #         "suggestedQuestions": faq_answer["suggestedQuestions"]
-        #     }
-        #     update_loading_message(room_id, loading_msg_id)
-        #     return jsonify(format_response_with_buttons(faq_answer["answer"], faq_answer["suggestedQuestions"]))
+        # Initialize the advisor with user profile data
+        advisor = TuftsCSAdvisor(user_profile)
 
         # ==== LLM PROCESSING ====
         # No cached or semantic match found, process with LLM
         logger.info("No FAQ match found - processing with LLM")
 
-        raw_res = advisor.get_faq_response(None, message)
-        print(raw_res)
-        
-        response_data = json.loads(raw_res)
-        response_text = response_data["response"]
-        category_id = response_data.get("category_id")
-        rc_payload = response_data.get("rocketChatPayload") 
+        # route as soon as the category is known: a category 4 reply flags the
+        # pending escalation while the rest of the reply is still generating
+        early_escalation = []
+        def on_field(name, value):
+            if name == "category_id" and value == "4":
+                early_escalation.append(background.submit(set_pending_escalation, user_collection, user_id))
+
+        reply_parser = IncrementalReplyParser(on_field=on_field)
+        try:
+            with stage_timer("llm.answer"):
+                if LLM_STREAMING:
+                    # edit the loading message as the answer streams in so the student
+                    # sees it forming instead of waiting for the whole generation
+                    updater = ProgressiveMessageUpdater(rocketchat, room_id, loading_msg_id,
+                                                        render=lambda _: reply_parser.partial_text("response"))
+                    updater.stream(reply_parser.consume(advisor.stream_faq_response(message)))
+                else:
+                    reply_parser.feed(advisor.get_faq_response(None, message))
+            logger.debug("LLM reply: %s", reply_parser.text)
+
+            # tolerant parse: fences, chatter and small syntax errors are repaired locally
+            response_data = reply_parser.result()
+            response_text = response_data["response"]
+            category_id = response_data.get("category_id")
+            rc_payload = response_data.get("rocketChatPayload")
+            if category_id == "4":
+                # the confirmation needs the summarized question; check it before committing to the handoff
+                original_question = rc_payload["originalQuestion"]
+        except Exception:
+            if early_escalation:
+                # the flag went up as soon as category 4 streamed in, but the reply
+                # is unusable: take it back down so the student is not stuck pending
+                early_escalation[0].exception()  # wait for the write, whatever its outcome
+                user_collection.update_one(
+                    {"user_id": user_id},
+                    {"$set": {"pending_escalation": False}}
+                )
+            raise
+        set_query_labels(category_id=category_id, path="llm")
+
+        # only answers grounded on the indexed handbooks are worth replaying
+        if advisor.corpus_ready:
+            response_cache.put(message, user_profile, corpus_version, response_data)
+
+        # keep the rolling summary of older turns current, off the request path
+        history_manager.record_turn(user_id, user_profile.get("last_k", 0) + 1, message, response_text)
         
         # ==== HUMAN ESCALATION ====
         # category_id=4, user explicitly wants to talk to a human advisor
         if category_id == "4":
-            original_question = rc_payload["originalQuestion"]
-            user_collection = get_collection("Users", "user")
-
-            user_collection.update_one(
-                {"user_id": user_id},
-                {"$set": {"pending_escalation": True}}  # Set pending_escalation to True
-            )
+            if early_escalation:
+                early_escalation[0].result()
+            else:
+                set_pending_escalation(user_collection, user_id)
 
-            response = requests.post(f"{RC_BASE_URL}/chat.update", json={
-                "roomId": room_id,
-                "msgId": loading_msg_id,
-                "text": response_text
-            }, headers=HEADERS)
+            update_loading_message(room_id, loading_msg_id, response_text)
 
-            return format_summary_confirmation(original_question)
+            return format_summary_confirmation(original_question), 200
 
         # Check if LLM determined human escalation is needed
         elif rc_payload:
@@ -481,7 +680,11 @@ def main():
             llm_answer = rc_payload.get("llmAnswer")
             uncertain_areas = rc_payload.get("uncertainAreas")
 
-            build_bidirectional_threads(user, original_question, llm_answer, message_id, uncertain_areas)
+            build_bidirectional_threads(
+                user, original_question, llm_answer, message_id, uncertain_areas,
+                room_id=room_id, loading_msg_id=loading_msg_id,
+                loading_text=f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button."
+            )
 
             # # Forward to human advisor and get the response
             # forward_res = send_to_human(user, original_question)
@@ -513,24 +716,60 @@ def main():
             #     "msgId": loading_msg_id,
             #     "text": f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button."
             # }, headers=HEADERS)
-            update_loading_message(room_id, loading_msg_id, f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button.")
-
-            return jsonify({
+            return {
                 "text": response_text,
                 "tmid": message_id
-            })
+            }, 200
 
         # ==== STANDARD LLM RESPONSE ====
         # Return LLM-generated response with suggested follow-up questions
         else:
             logger.info("Returning standard LLM response with suggested questions")
             update_loading_message(room_id, loading_msg_id)
-            return format_response_with_buttons(response_data["response"], response_data.get("suggestedQuestions"), category_id)
+            return format_response_with_buttons(response_data["response"], response_data.get("suggestedQuestions"), category_id), 200
 
     except Exception as e:
-        traceback.print_exc()
-        print(f"Error processing request: {str(e)}")
-        return jsonify({"text": "There was an error processing your request. Could you please try again?"})
+        logger.exception("Error processing request: %s", e)
+        return {"text": "There was an error processing your request. Could you please try again?"}, 200
+
+def process_query_async(data):
+    """
+    Worker-side half of async mode: answers a queued message and posts the
+    reply to the student's room, since there is no webhook response to carry it.
+    """
+    body, _ = handle_query(data)
+    if body.get("text"):
+        rocketchat.post_message({"roomId": data.get("channel_id"), **body})
+
+@app.route('/query', methods=['POST'])
+def main():
+    """
+    Main endpoint for handling user queries to the Tufts CS Advisor.
+
+    With ASYNC_QUERY enabled the message is validated, queued behind any
+    earlier message from the same student and acknowledged immediately;
+    a worker thread produces the answer and posts it to RocketChat.
+    """
+    data = request.get_json()
+
+    if not ASYNC_QUERY:
+        body, status = handle_query(data)
+        return jsonify(body), status
+
+    # Ignore bot messages
+    if data.get("bot") or not data.get("text"):
+        return jsonify({"status": "ignored"})
+
+    if not data.get("user_id") or not data.get("channel_id"):
+        return jsonify({"text": "Error: missing user or channel"}), 400
+
+    try:
+        query_queue.submit(data.get("user_id"), process_query_async, data)
+    except QueueFullError:
+        logger.warning("query queue is full, rejecting message from %s", data.get("user_name"))
+        return jsonify({"text": "The advising bot is busy right now. Could you please try again in a minute?"})
+
+    return jsonify({"success": True}), 200
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -540,6 +779,44 @@ def page_not_found(e):
 def hello_world():
    return jsonify({"text": 'Hello from Koyeb - you reached the main page!'})
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Endpoint exposing per-route, per-category and per-stage latency histograms
+    in Prometheus text format.
+    """
+    return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/pool-stats')
+def pool_stats():
+    """
+    Endpoint exposing outbound HTTP connection pool statistics for monitoring.
+    """
+    return jsonify({
+        "llmproxy": get_pool_stats(),
+        "rocketchat": rocketchat.get_stats(),
+        "query_queue": query_queue.get_stats(),
+        "corpus": get_corpus().get_state(),
+        "response_cache": response_cache.get_stats(),
+        "faq_matcher": faq_matcher.get_stats(),
+        "rag_profiles": rag_profile_classifier.get_stats(),
+        "intent_router": intent_router.get_stats(),
+        "history": history_manager.get_stats(),
+        "email_queue": get_email_queue().get_stats(),
+        "thread_cache": thread_cache.get_stats(),
+        "logging": get_logging_stats()
+    })
+
+def faqs_changed():
+    """
+    Invalidate FAQ-derived state after freq_questions.questions was edited.
+
+    The local FAQ matcher is updated in place by the caller; bumping the shared
+    version makes other workers clear their answer cache and re-index.
+    """
+    version = response_cache.invalidate_all()
+    faq_matcher.sync_version(version)
+
 @app.route('/faqs', methods=['GET', 'POST'])
 def display_faqs():
     """
@@ -590,9 +867,21 @@ def display_faqs():
                     "suggestedQuestions": suggested_questions
                 }}
             )
+            if isinstance(question_id, int):
+                # an edited ID may be above the counter; keep later adds from reusing it
+                reserve_question_ids(question_id)
             
-            # Redirect to avoid form resubmission
-            return redirect('/faqs')
+            faq_matcher.upsert({
+                "_id": doc_id,
+                "question": question,
+                "answer": answer,
+                "question_id": question_id,
+                "suggestedQuestions": suggested_questions
+            })
+            faqs_changed()
+
+            # Redirect back to the same page to avoid form resubmission
+            return redirect(request.full_path.rstrip('?'))
         
         # Handle form submission for adding new documents
         elif request.method == 'POST' and request.form.get('action') == 'add':
@@ -609,27 +898,22 @@ def display_faqs():
                 suggested_questions.append(sq)
                 i += 1
             
-            # Get all documents to determine highest question_id
+            # Allocate the next question_id atomically instead of scanning for the max
             collection = mongo_client[db_name][collection_name]
-            all_docs = list(collection.find({}, {"question_id": 1}))
-            
-            # Find the highest question_id
-            highest_id = 0
-            for doc in all_docs:
-                if 'question_id' in doc and isinstance(doc['question_id'], int) and doc['question_id'] > highest_id:
-                    highest_id = doc['question_id']
-            
-            # Use the next available ID
-            next_id = highest_id + 1
+            next_id = next_question_id()
             
             # Insert the new document
-            collection.insert_one({
+            new_doc = {
                 "question": question,
                 "answer": answer,
                 "question_id": next_id,
                 "suggestedQuestions": suggested_questions
-            })
+            }
+            collection.insert_one(new_doc)
             
+            faq_matcher.upsert(new_doc)
+            faqs_changed()
+
             # Redirect to avoid form resubmission
             return redirect('/faqs')
         
@@ -638,29 +922,28 @@ def display_faqs():
             doc_id = request.form.get('doc_id')
             collection = mongo_client[db_name][collection_name]
             collection.delete_one({"_id": ObjectId(doc_id)})
-            return redirect('/faqs')
-        
-        # Get all documents from freq_questions.questions collection
-        collection = mongo_client[db_name][collection_name]
+            faq_matcher.remove(doc_id)
+            faqs_changed()
+            return redirect(request.full_path.rstrip('?'))
         
-        # Sort by question_id for better organization
-        documents = list(collection.find({}).sort("question_id", 1))
-        
-        # Get the highest question_id for new questions
-        highest_id = 0
-        for doc in documents:
-            if 'question_id' in doc and isinstance(doc['question_id'], int) and doc['question_id'] > highest_id:
-                highest_id = doc['question_id']
-        
-        # Convert ObjectId to string for display
-        for doc in documents:
-            doc['_id'] = str(doc['_id'])
+        # Render one page, optionally filtered by a text search
+        search = request.args.get('q', '').strip()
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', PAGE_SIZE, type=int)
+
+        page = list_faqs(search=search or None, after=after, before=before, limit=limit)
         
         # Pass data to the template and render it
         return render_template(
             'faqs.html',  # Use the combined template
-            documents=documents,
-            next_id=highest_id + 1,
+            documents=page["documents"],
+            next_after=page["next_after"],
+            prev_before=page["prev_before"],
+            search=search,
+            limit=limit,
+            total=None if search else count_faqs(),
+            next_id=peek_next_question_id(),
             enumerate=enumerate
         )
     
@@ -668,6 +951,61 @@ def display_faqs():
         logger.error(f"Error in database view: {str(e)}")
         return render_template('error.html', error_message=str(e))
 
+def _faq_file_format(filename, default="jsonl"):
+    fmt = request.args.get('format')
+    if not fmt and filename:
+        fmt = filename.rsplit('.', 1)[-1]
+    fmt = (fmt or default).lower()
+    return "jsonl" if fmt in ("json", "ndjson") else fmt
+
+@app.route('/faqs/import', methods=['POST'])
+def import_faq_file():
+    """
+    Bulk-imports FAQs from a JSONL or CSV file.
+
+    The file can be sent as the "file" field of a form upload or as the raw
+    request body (format from ?format= or the file extension). Rows are
+    validated and written in ordered batches; rows with a question_id replace
+    that FAQ, rows without one are added with new IDs.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = _faq_file_format(upload.filename if upload else None)
+    if fmt not in ("jsonl", "csv"):
+        return jsonify({"error": "format must be jsonl or csv"}), 400
+
+    def refresh_faq_caches(question_ids):
+        # keep this worker's matcher current and tell the others once per batch
+        for doc in find_faqs_by_question_id(question_ids):
+            faq_matcher.upsert(doc)
+        faqs_changed()
+
+    try:
+        summary = import_faqs(stream, fmt, on_batch=refresh_faq_caches)
+    except UnicodeDecodeError:
+        return jsonify({"error": "file must be UTF-8 encoded"}), 400
+    except csv.Error as e:
+        return jsonify({"error": f"malformed CSV: {e}"}), 400
+
+    logger.info("FAQ import finished: %s rows, %s invalid, %s batches",
+                summary["rows"], summary["invalid"], summary["batches"])
+    return jsonify(summary), 200 if summary["write_error"] is None else 409
+
+@app.route('/faqs/export')
+def export_faq_file():
+    """
+    Streams every FAQ as JSONL (default) or CSV (?format=csv).
+    """
+    fmt = _faq_file_format(None)
+    if fmt not in ("jsonl", "csv"):
+        return jsonify({"error": "format must be jsonl or csv"}), 400
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(export_faqs(fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=faqs.{fmt}"}
+    )
+
 @app.route('/student-info', methods=['GET', 'POST'])
 def student_info():
     """
@@ -761,6 +1099,10 @@ def student_info():
             except:
                 # If not a valid ObjectId, try to update by user_id
                 result = user_collection.update_one({"user_id": student_id}, update_doc)
+
+            # cached prompt sections are also keyed by transcript hash, so this
+            # only frees the stale entry early
+            invalidate_student_prompt(student_id)
             
             if result.modified_count > 0:
                 return jsonify({"success": True, "message": "Student information updated successfully"})
@@ -810,6 +1152,13 @@ if __name__ == "__main__":
     # Register shutdown handler to close MongoDB connection when app stops
     import atexit
     from utils.mongo_config import close_mongodb_connection
+    from llmproxy import close_session
+    from utils.rocketchat import close_rocketchat_client
+    from utils.emails import close_email_queue
     atexit.register(close_mongodb_connection)
+    atexit.register(close_session)
+    atexit.register(close_rocketchat_client)
+    atexit.register(close_email_queue)
+    atexit.register(history_manager.close)
     
     app.run(debug=True, host="0.0.0.0", port=5999)
\ No newline at end of file
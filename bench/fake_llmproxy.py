@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the LLMProxy endpoint, for trying out streaming and for load tests.
+
+Usage:
+    python -m bench.fake_llmproxy --port 8701 --latency 0.5 --chunk-delay 0.02
+    endPoint=http://127.0.0.1:8701 LLM_STREAMING=true python app.py
+
+It answers the request shapes llmproxy.py sends:
+    - generate: JSON body -> {"result", "rag_context"}, or a server-sent event
+      stream of {"delta": ...} chunks when the body has "stream": true
+    - retrieve: request_type: retrieve header -> a small rag_context list
+    - upload: multipart/form-data -> 200
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLIES = {
+    "escalation": {
+        "llmAnswer": "MSCS students need ten courses; based on what you shared, you likely have six remaining.",
+        "uncertainAreas": "The student's transferred credits are unknown."
+    },
+    "human": {
+        "category_id": "4",
+        "response": "I noticed you are asking about your course plan. Let me help you connect with a human advisor.",
+        "rocketChatPayload": {
+            "originalQuestion": "The student wants help planning their remaining courses.",
+            "llmAnswer": "Based on the CS Graduate Handbook Supplement, MSCS students need 10 courses.",
+            "uncertainAreas": "The student's completed courses are unknown."
+        }
+    },
+    "default": {
+        "category_id": "2",
+        "response": "According to the [CS Graduate Handbook Supplement](https://tufts.app.box.com/v/cs-grad-handbook-supplement), "
+                    "page 4: \"The MSCS degree requires ten courses (30 credits).\" At least five must be CS courses at the 100 level or above.",
+        "suggestedQuestions": [
+            "Which courses count toward the breadth requirement?",
+            "Can I take courses outside the CS department?",
+            "How many transfer credits can I apply to the MSCS?"
+        ]
+    }
+}
+
+SUMMARY_REPLY = "The student asked how many courses the MSCS requires and was told ten (30 credits)."
+
+RAG_CONTEXT = [{
+    "doc_id": "cs_handbook.pdf",
+    "doc_summary": "CS Graduate Handbook Supplement",
+    "chunks": ["The MSCS degree requires ten courses (30 credits)."]
+}]
+
+
+def pick_reply(query, system=""):
+    if "running summary" in (system or ""):
+        return SUMMARY_REPLY
+    if "CATEGORY 1" not in (system or "") and "llmAnswer" in (system or ""):
+        return json.dumps(REPLIES["escalation"])
+    if "human" in (query or "").lower():
+        return json.dumps(REPLIES["human"])
+    return json.dumps(REPLIES["default"])
+
+
+def make_handler(latency=0.5, chunk_delay=0.02, chunk_size=8, streaming=True):
+    class FakeLLMProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real proxy
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+
+            if self.headers.get("request_type") == "retrieve":
+                self._send_json(RAG_CONTEXT)
+                return
+            if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+                self._send_json({"status": "ok"})
+                return
+
+            request = json.loads(body or b"{}")
+            reply = pick_reply(request.get("query"), request.get("system"))
+            time.sleep(latency)
+
+            if not (streaming and request.get("stream")):
+                self._send_json({"result": reply, "rag_context": []})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(reply), chunk_size):
+                event = json.dumps({"delta": reply[i:i + chunk_size]})
+                self._write_chunk(f"data: {event}\n\n".encode("utf-8"))
+                time.sleep(chunk_delay)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+    return FakeLLMProxyHandler
+
+
+def start_server(host="127.0.0.1", port=0, **config):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: call .shutdown() to stop; .server_address has the bound port
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(**config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the LLMProxy endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first byte of a reply")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument("--chunk-size", type=int, default=8, help="characters per streamed chunk")
+    parser.add_argument("--no-streaming", action="store_true", help="ignore the stream flag, like an older proxy")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(
+        latency=args.latency, chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size, streaming=not args.no_streaming
+    ))
+    print(f"fake LLMProxy listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
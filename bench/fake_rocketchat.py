@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the RocketChat REST API, for load tests.
+
+Usage:
+    python -m bench.fake_rocketchat --port 8702 --latency 0.03
+    RC_BASE_URL=http://127.0.0.1:8702/api/v1 python app.py
+
+It answers the methods the app calls (chat.postMessage, chat.update and
+chat.delete) with the fields the app reads back, and counts calls per method.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(latency=0.03):
+    ids = itertools.count(1)
+
+    class FakeRocketChatHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            with self.server.lock:
+                self.server.calls[method] = self.server.calls.get(method, 0) + 1
+            time.sleep(latency)
+
+            if method == "chat.postMessage":
+                room_id = payload.get("roomId") or payload.get("channel") or "bench-room"
+                self._send_json({
+                    "success": True,
+                    "message": {
+                        "_id": f"bench-msg-{next(ids)}",
+                        "rid": room_id,
+                        "msg": payload.get("text", ""),
+                        "tmid": payload.get("tmid")
+                    }
+                })
+            elif method in ("chat.update", "chat.delete"):
+                self._send_json({"success": True, "message": {"_id": payload.get("msgId"), "rid": payload.get("roomId")}})
+            else:
+                self._send_json({"success": False, "error": f"{method} is not implemented"}, status=404)
+
+    return FakeRocketChatHandler
+
+
+class FakeRocketChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.lock = threading.Lock()
+        self.calls = {}
+
+
+def start_server(host="127.0.0.1", port=0, **config):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        FakeRocketChatServer: call .shutdown() to stop; .server_address has the
+        bound port and .calls counts requests per REST method
+    """
+    server = FakeRocketChatServer((host, port), make_handler(**config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the RocketChat REST API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8702)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds before each reply")
+    args = parser.parse_args()
+
+    server = FakeRocketChatServer((args.host, args.port), make_handler(latency=args.latency))
+    print(f"fake RocketChat listening on http://{args.host}:{args.port}/api/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in SMTP server, for trying out the outbound email queue.
+
+Usage:
+    python -m bench.fake_smtp --port 8025 --handshake-delay 1.0
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=false python app.py
+
+It speaks just enough SMTP for smtplib: EHLO/HELO, AUTH PLAIN/LOGIN (any
+credentials are accepted), MAIL, RCPT, DATA, RSET, NOOP and QUIT. STARTTLS
+is not offered. A handshake delay mimics a remote server's greeting plus
+login cost, and every Nth message can be refused with a 451 to exercise
+retries. Received messages are kept in memory on the server object.
+"""
+import argparse
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+def make_handler(handshake_delay=0.0, fail_every=0):
+    class FakeSMTPHandler(socketserver.StreamRequestHandler):
+        def _reply(self, line):
+            self.wfile.write(f"{line}\r\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def _read_line(self):
+            line = self.rfile.readline()
+            if not line:
+                return None
+            return line.decode("utf-8", "replace").rstrip("\r\n")
+
+        def _read_data(self):
+            lines = []
+            while True:
+                line = self.rfile.readline()
+                if not line or line in (b".\r\n", b".\n"):
+                    break
+                if line.startswith(b".."):
+                    line = line[1:]  # undo dot-stuffing
+                lines.append(line)
+            return b"".join(lines)
+
+        def _accept(self, data):
+            stats = self.server.stats
+            with self.server.lock:
+                stats["attempts"] += 1
+                refuse = fail_every and stats["attempts"] % fail_every == 0
+                if not refuse:
+                    self.server.messages.append(message_from_bytes(data))
+                    stats["messages"] += 1
+            if refuse:
+                self._reply("451 4.3.0 Temporary failure, try again later")
+            else:
+                self._reply("250 2.0.0 OK: queued")
+
+        def handle(self):
+            with self.server.lock:
+                self.server.stats["connections"] += 1
+            time.sleep(handshake_delay)
+            self._reply("220 fake-smtp ESMTP ready")
+
+            while True:
+                line = self._read_line()
+                if line is None:
+                    return
+                command = line.split(" ", 1)[0].upper()
+
+                if command == "EHLO":
+                    self._reply("250-fake-smtp")
+                    self._reply("250-AUTH PLAIN LOGIN")
+                    self._reply("250 8BITMIME")
+                elif command == "HELO":
+                    self._reply("250 fake-smtp")
+                elif command == "AUTH":
+                    parts = line.split()
+                    mechanism = parts[1].upper() if len(parts) > 1 else ""
+                    # LOGIN asks for the username (unless sent inline) and the
+                    # password; PLAIN asks once unless the credentials were inline
+                    prompts = ["UGFzc3dvcmQ6"] if mechanism == "LOGIN" else []
+                    if len(parts) == 2:
+                        prompts.insert(0, "VXNlcm5hbWU6" if mechanism == "LOGIN" else "")
+                    for prompt in prompts:
+                        self._reply(f"334 {prompt}")
+                        if self._read_line() is None:
+                            return
+                    self._reply("235 2.7.0 Authentication successful")
+                elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    self._reply("250 2.0.0 OK")
+                elif command == "DATA":
+                    self._reply("354 End data with <CR><LF>.<CR><LF>")
+                    self._accept(self._read_data())
+                elif command == "QUIT":
+                    self._reply("221 2.0.0 Bye")
+                    return
+                else:
+                    self._reply("502 5.5.2 Command not implemented")
+
+    return FakeSMTPHandler
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.stats = {"connections": 0, "attempts": 0, "messages": 0}
+
+
+def start_server(host="127.0.0.1", port=0, **config):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        FakeSMTPServer: call .shutdown() to stop; .server_address has the bound
+        port, .messages and .stats record what was received
+    """
+    server = FakeSMTPServer((host, port), make_handler(**config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in SMTP server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--handshake-delay", type=float, default=0.0, help="seconds before the greeting of each connection")
+    parser.add_argument("--fail-every", type=int, default=0, help="refuse every Nth message with a 451")
+    args = parser.parse_args()
+
+    server = FakeSMTPServer((args.host, args.port), make_handler(
+        handshake_delay=args.handshake_delay, fail_every=args.fail_every
+    ))
+    print(f"fake SMTP server listening on {args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
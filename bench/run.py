@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Offline load test for /query against local stand-ins.
+
+Usage:
+    pip install mongomock
+    python -m bench.run
+    python -m bench.run --concurrency 1,8,32 --requests 200 --scenarios faq,thread
+    python -m bench.run --compare bench/results/<older commit>.json
+
+The app is served in-process by a threaded WSGI server. LLMProxy and
+RocketChat are replaced by bench.fake_llmproxy and bench.fake_rocketchat,
+and Mongo by mongomock (or a real mongod with --mongo-uri). Payloads are
+replayed from bench/payloads.jsonl, one scenario at a time:
+    faq         questions answered from the FAQ bank (bench/faqs.jsonl)
+    llm         new questions answered by the (fake) LLM
+    escalation  a category 4 request followed by the question summary
+    router      greetings, thank-yous and handoff buttons answered without the LLM
+    thread      messages posted inside an existing escalation thread
+
+For every scenario and client worker count, the p50/p95/p99 latency and the
+requests per second are printed. They are also saved to
+bench/results/<commit>.json so later commits can be compared with --compare.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+PAYLOADS_FILE = os.path.join(BENCH_DIR, "payloads.jsonl")
+FAQS_FILE = os.path.join(BENCH_DIR, "faqs.jsonl")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+SCENARIOS = ["faq", "llm", "escalation", "router", "thread"]
+# handle_query answers internal failures with 200 and this text
+APP_ERROR_TEXT = "There was an error processing your request"
+
+
+def load_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def git_revision():
+    """
+    Return (short commit hash, dirty flag) of the tree being measured.
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short=10", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, text=True)
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", True
+
+
+def start_stack(args):
+    """
+    Start the stand-ins, import the app against them and serve it.
+
+    Returns:
+        tuple: (base URL of the app, app module, fake RocketChat server)
+    """
+    from bench import fake_llmproxy, fake_rocketchat
+
+    llm = fake_llmproxy.start_server(latency=args.llm_latency, chunk_delay=args.chunk_delay)
+    rc = fake_rocketchat.start_server(latency=args.rc_latency)
+
+    # the app reads its configuration from the environment at import time
+    os.environ["endPoint"] = f"http://127.0.0.1:{llm.server_address[1]}"
+    os.environ.setdefault("apiKey", "bench")
+    os.environ["RC_BASE_URL"] = f"http://127.0.0.1:{rc.server_address[1]}/api/v1"
+    os.environ.setdefault("RC_token", "bench")
+    os.environ.setdefault("RC_userId", "bench")
+    os.environ["LLM_STREAMING"] = "true" if args.streaming else "false"
+    os.environ["ESCALATION_EMAIL"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "advisor-bench.log"))
+    if not args.response_cache:
+        # measure the LLM path every time instead of replaying cached answers
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+
+    sys.path.insert(0, ROOT_DIR)
+    os.chdir(ROOT_DIR)
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+        import app
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required without --mongo-uri: pip install mongomock")
+        with mongomock.patch(servers=(("localhost", 27017),)):
+            import utils.mongo_config  # the module-level client becomes a mongomock client
+        import app
+
+    seed_faqs(app)
+    if not app.get_corpus().wait_until_ready(timeout=30):
+        print("⚠️  handbook corpus is not ready, answers will use the indexing notice")
+
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log line per request
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", app, rc
+
+
+def seed_faqs(app):
+    collection = app.get_collection("freq_questions", "questions")
+    collection.delete_many({})
+    collection.insert_many(load_jsonl(FAQS_FILE))
+    app.faq_matcher.load()
+
+
+def build_job(template, job_id, thread_collection):
+    """
+    Turn one corpus line into concrete webhook payloads for a fresh user.
+
+    "$thread:student" / "$thread:advisor" tmids are replaced with a thread
+    mapping created for this job, as if an escalation had already happened.
+    """
+    user_id = f"bench-user-{job_id}"
+    payloads = []
+    for step, fields in enumerate(template["steps"]):
+        payload = {
+            "token": "bench",
+            "bot": False,
+            "channel_id": f"bench-room-{job_id}",
+            "user_id": user_id,
+            "user_name": f"bench{job_id}",
+            "message_id": f"bench-{job_id}-{step}",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        payload.update(fields)
+
+        tmid = payload.get("tmid")
+        if isinstance(tmid, str) and tmid.startswith("$thread:"):
+            student_thread = f"bench-student-thread-{job_id}"
+            advisor_thread = f"bench-advisor-thread-{job_id}"
+            thread_collection.insert_many([
+                {"thread_id": student_thread, "forward_thread_id": advisor_thread, "forward_human": True},
+                {"thread_id": advisor_thread, "forward_thread_id": student_thread, "forward_human": False,
+                 "forward_username": payload["user_name"]}
+            ])
+            payload["tmid"] = student_thread if tmid == "$thread:student" else advisor_thread
+        payloads.append(payload)
+    return payloads
+
+
+def response_ok(response):
+    """
+    Tell whether /query actually answered: a 200 with a JSON reply body
+    (text, buttons or a thread acknowledgement) that is not the generic error.
+    """
+    if response.status_code != 200:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    if str(body.get("text", "")).startswith(APP_ERROR_TEXT):
+        return False
+    return bool(body.get("text") or body.get("attachments") or body.get("success"))
+
+
+def run_scenario(base_url, app, templates, concurrency, total_requests, job_ids):
+    """
+    Replay a scenario's payloads with `concurrency` client workers.
+
+    Returns:
+        dict: request count, errors, latency percentiles (ms) and throughput
+    """
+    import requests
+
+    thread_collection = app.get_collection("Users", "threads")
+    jobs = []
+    requests_planned = 0
+    for template in itertools.cycle(templates):
+        if requests_planned >= total_requests:
+            break
+        jobs.append(build_job(template, next(job_ids), thread_collection))
+        requests_planned += len(template["steps"])
+
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run_job(payloads):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        for payload in payloads:
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/query", json=payload, timeout=120)
+                ok = response_ok(response)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_job, jobs))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0
+    }
+
+
+def print_table(results, baseline=None):
+    previous = {}
+    for row in (baseline or {}).get("results", []):
+        previous[(row["scenario"], row["concurrency"])] = row
+
+    header = f"{'scenario':<11} {'workers':>7} {'reqs':>6} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        line = (f"{row['scenario']:<11} {row['concurrency']:>7} {row['requests']:>6} {row['errors']:>5} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['rps']:>8.1f}")
+        old = previous.get((row["scenario"], row["concurrency"]))
+        if old:
+            def delta(key):
+                return f"{(row[key] - old[key]) / old[key] * 100:+.0f}%" if old[key] else "n/a"
+            line += f"   vs baseline: p95 {delta('p95_ms')}, req/s {delta('rps')}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for /query.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated client worker counts")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and worker count")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds the fake LLMProxy waits before replying")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--rc-latency", type=float, default=0.02, help="seconds the fake RocketChat waits per call")
+    parser.add_argument("--streaming", action="store_true", help="run with LLM_STREAMING=true")
+    parser.add_argument("--response-cache", action="store_true", help="keep the answer cache on (repeat questions become cache hits)")
+    parser.add_argument("--mongo-uri", help="use this mongod instead of mongomock")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--no-save", action="store_true", help="do not write bench/results/<commit>.json")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    corpus = {}
+    for template in load_jsonl(PAYLOADS_FILE):
+        corpus.setdefault(template["scenario"], []).append(template)
+
+    base_url, app, rc = start_stack(args)
+    job_ids = itertools.count(1)
+
+    results = []
+    for scenario in scenarios:
+        for concurrency in concurrency_levels:
+            row = {"scenario": scenario, "concurrency": concurrency}
+            row.update(run_scenario(base_url, app, corpus[scenario], concurrency, args.requests, job_ids))
+            results.append(row)
+            print(f"  {scenario} x{concurrency}: p95 {row['p95_ms']:.1f} ms, {row['rps']:.1f} req/s")
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "requests": args.requests,
+            "llm_latency": args.llm_latency,
+            "rc_latency": args.rc_latency,
+            "streaming": args.streaming,
+            "response_cache": args.response_cache,
+            "mongo": "mongod" if args.mongo_uri else "mongomock"
+        },
+        "rocketchat_calls": dict(rc.calls),
+        "results": results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nbaseline: {baseline.get('commit')} ({baseline.get('timestamp')})")
+    print()
+    print_table(results, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved {os.path.relpath(path, ROOT_DIR)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 import os
 import json
+import threading
 import requests
 from typing import Tuple
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.metrics import timed
 
 load_dotenv()
 
@@ -10,6 +15,114 @@ load_dotenv()
 end_point = os.environ.get("endPoint")
 api_key = os.environ.get("apiKey")
 
+# HTTP client tuning (shared by generate / pdf_upload / text_upload)
+POOL_SIZE = int(os.environ.get("LLMPROXY_POOL_SIZE", "20"))  # Max keep-alive connections per host
+CONNECT_TIMEOUT = float(os.environ.get("LLMPROXY_CONNECT_TIMEOUT", "5"))  # Seconds to establish TCP+TLS
+READ_TIMEOUT = float(os.environ.get("LLMPROXY_READ_TIMEOUT", "120"))  # Seconds to wait for the model
+MAX_RETRIES = int(os.environ.get("LLMPROXY_MAX_RETRIES", "3"))  # Retries on 429/503 and failed connects
+BACKOFF_FACTOR = float(os.environ.get("LLMPROXY_BACKOFF_FACTOR", "0.5"))  # 0.5s, 1s, 2s, ...
+# Only statuses that mean the request was turned away before any work was done;
+# a 500/502/504 may come back after the proxy already ran (and stored) the turn.
+RETRY_STATUS = (429, 503)
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0, "non_200": 0}
+
+
+def _build_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,  # never replay a request the proxy may already be generating for
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry, pool_block=False)
+
+    session = requests.Session()
+    session.headers.update({'x-api-key': api_key, 'Connection': 'keep-alive'})
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the module-level pooled session used for every LLMProxy call.
+
+    Returns:
+        requests.Session: keep-alive session with bounded retries on 429/503 and failed connects
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _post(**kwargs):
+    with _stats_lock:
+        _stats["requests"] += 1
+    try:
+        response = get_session().post(end_point, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+    except requests.exceptions.RequestException:
+        with _stats_lock:
+            _stats["errors"] += 1
+        raise
+    if response.status_code != 200:
+        with _stats_lock:
+            _stats["non_200"] += 1
+    return response
+
+
+def get_pool_stats():
+    """
+    Report request counters and connection pool usage for monitoring.
+
+    Returns:
+        dict: request/error counters plus, per proxy host, the number of
+        connections opened, requests served and idle connections in the pool
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    pools = []
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pool_manager = adapter.poolmanager
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests_served": pool.num_requests,
+                    "idle_connections": pool.pool.qsize() if pool.pool else 0,
+                    "max_size": POOL_SIZE
+                })
+    stats["pools"] = pools
+    return stats
+
+
+def close_session():
+    """
+    Close the pooled session - should only be called when the application shuts down.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+@timed("llmproxy.generate")
 def generate(
 	model: str,
 	system: str,
@@ -22,10 +135,6 @@ def generate(
     rag_k: int | None = 0
 	):
 	
-    headers = {
-        'x-api-key': api_key
-    }
-
     request = {
         'model': model,
         'system': system,
@@ -39,7 +148,7 @@ def generate(
     }
     msg = None
     try:
-        response = requests.post(end_point, headers=headers, json=request)
+        response = _post(json=request)
         if response.status_code == 200:
             res = json.loads(response.text)
             msg = {'response':res['result'],'rag_context':res['rag_context']}
@@ -49,14 +158,128 @@ def generate(
         msg = f"An error occurred: {e}"
     return msg
 
-def upload(multipart_form_data):
-    headers = {
-        'x-api-key': api_key
+def generate_stream(
+    model: str,
+    system: str,
+    query: str,
+    temperature: float | None = None,
+    lastk: int | None = None,
+    session_id: str | None = None,
+    rag_threshold: float | None = 0.5,
+    rag_usage: bool | None = False,
+    rag_k: int | None = 0
+    ):
+    """
+    Streaming variant of generate: yields the model output as text chunks.
+
+    Server-sent events ("data: ..." lines, optionally JSON with a
+    'delta'/'result' field, terminated by "data: [DONE]") and raw chunked
+    bodies are both accepted. If the proxy ignores the stream flag and
+    answers with a regular JSON body, the whole result is yielded once.
+
+    Raises:
+        requests.exceptions.RequestException: on connection errors or a non-200 response
+    """
+    request = {
+        'model': model,
+        'system': system,
+        'query': query,
+        'temperature': temperature,
+        'lastk': lastk,
+        'session_id': session_id,
+        'rag_threshold': rag_threshold,
+        'rag_usage': rag_usage,
+        'rag_k': rag_k,
+        'stream': True
+    }
+
+    with _post(json=request, stream=True, headers={'Accept': 'text/event-stream'}) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+
+        if content_type.startswith('application/json'):
+            yield json.loads(response.text)['result']
+            return
+
+        if content_type.startswith('text/event-stream'):
+            done = False
+            for line in response.iter_lines(decode_unicode=True):
+                # keep reading after [DONE] so the connection goes back to the pool
+                if done or not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    done = True
+                    continue
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    yield data
+                    continue
+                if isinstance(event, dict):
+                    chunk = event.get('delta', event.get('result', ''))
+                    if chunk:
+                        yield chunk
+                elif isinstance(event, str):
+                    yield event
+                else:
+                    # a bare token such as 2 or true that happens to parse as JSON
+                    yield data
+            return
+
+        response.encoding = response.encoding or 'utf-8'
+        for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+            if chunk:
+                yield chunk
+
+@timed("llmproxy.retrieve")
+def retrieve(
+    query: str,
+    session_id: str,
+    rag_threshold: float | None = 0.5,
+    rag_k: int | None = 5
+    ):
+    """
+    Fetch the RAG chunks matching a query from a session without calling the model.
+
+    Returns:
+        list or str: rag_context entries on success, an error message otherwise
+    """
+    request = {
+        'query': query,
+        'session_id': session_id,
+        'rag_threshold': rag_threshold,
+        'rag_k': rag_k
     }
 
     msg = None
     try:
-        response = requests.post(end_point, headers=headers, files=multipart_form_data)
+        response = _post(json=request, headers={'request_type': 'retrieve'})
+        if response.status_code == 200:
+            msg = json.loads(response.text)
+        else:
+            msg = f"Error: Received response code {response.status_code}"
+    except requests.exceptions.RequestException as e:
+        msg = f"An error occurred: {e}"
+    return msg
+
+def rag_context_string_simple(rag_context):
+    """
+    Format retrieved rag_context entries as plain text to append to a system prompt.
+    """
+    context_string = ""
+    for i, collection in enumerate(rag_context, 1):
+        if not context_string:
+            context_string = "The following is additional context that may be helpful in answering the user's query."
+        context_string += f"\n#{i} {collection.get('doc_summary', '')}"
+        for j, chunk in enumerate(collection.get('chunks', []), 1):
+            context_string += f"\n#{i}.{j} {chunk}"
+    return context_string
+
+def upload(multipart_form_data):
+    msg = None
+    try:
+        response = _post(files=multipart_form_data)
         
         if response.status_code == 200:
             msg = "Successfully uploaded. It may take a short while for the document to be added to your context"
@@ -68,6 +291,7 @@ def upload(multipart_form_data):
     return msg
 
 
+@timed("llmproxy.upload")
 def pdf_upload(
     path: str,    
     strategy: str | None = None,
@@ -81,14 +305,19 @@ def pdf_upload(
         'strategy': strategy
     }
 
+    # read the file up front so a retried request resends the full body
+    with open(path, 'rb') as f:
+        content = f.read()
+
     multipart_form_data = {
         'params': (None, json.dumps(params), 'application/json'),
-        'file': (None, open(path, 'rb'), "application/pdf")
+        'file': (None, content, "application/pdf")
     }
 
     response = upload(multipart_form_data)
     return response
 
+@timed("llmproxy.upload")
 def text_upload(
     text: str,    
     strategy: str | None = None,
@@ -9,14 +9,23 @@ designed specifically for the Master of Science in Computer Science program at T
 
 # greeting_msg = """I'm here to help you with a wide range of Computer Science advising topics:\\n- **Program Requirements**\\n    - \\\"What are the core competency areas for the MSCS program?\\\"\\n    - \\\"How many courses are required to complete a Master's in Computer Science at Tufts?\\\"\\n- **Academic Policies**\\n    - \\\"What is the transfer credit policy for Computer Science graduate students?\\\"\\n    - \\\"What are the requirements for maintaining good academic standing in the graduate program?\\\"\\n- **Course-related Information**\\n    - \\\"Does taking CS160 count towards my graduation requirement?\\\"\\n    - \\\"Can I take non-CS courses in my degree program?\\\"\\n- **Career Development**\\n    - \\\"What Co-op opportunities are available?\\\"\\n    - \\\"Can international students do internships as part of the program?\\\"\\n- **Administrative Questions**\\n    - \\\"When are the enrollment periods?\\\"\\n    - \\\"What important dates should I keep in mind?\\\"\\n\\n :kirby_fly: Want a **more personalized** advising experience? I just need a little more info from you:\\n- Your program status (e.g., \\\"First-year MSCS student\\\")\\n- Courses you've already completed (e.g., \\\"CS 105, CS 160\\\")\\n- Are you an international student?\\n- Your current GPA (if applicable)\\n**Totally optional**, and you're welcome to continue without it!\\n\\n :kirby_type: To speak with a human advisor, just type: \\\"**talk to a human advisor**\\\" or click on the \\\"**Connect**\\\" button below"
 import os
+import json
+import hashlib
+from string import Formatter
 from dotenv import load_dotenv
 
+from utils.cache import LRUCache
+
 # Load environment variables from .env file
 load_dotenv()
 BASE_URL = os.environ.get("koyeb_url", "https://shy-moyna-wendanj-b5959963.koyeb.app")
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "1024"))  # Students whose rendered sections are kept
 
-def get_system_prompt(user_profile):
-    greeting_msg = f"""
+# The prompts below are plain templates (not f-strings): they are parsed once at
+# import into literal chunks and field names, and rendering a prompt is a single
+# join of those chunks with the student's values. Double braces are literal JSON braces.
+
+GREETING_TEMPLATE = """
 
 I'm here to help you with a wide range of Computer Science advising topics:
 💡 **Program Requirements**  - \"What are the core competency areas for the MSCS program?\"
@@ -25,32 +34,27 @@ I'm here to help you with a wide range of Computer Science advising topics:
 🌱 **Career Development**  - \"What Co-op opportunities are available?\"
 📝 **Administrative Questions**  - \"When are registration dates?\"
 
- :kirby_fly: Want a **more personalized** advising experience? Just share a bit more info using [this link]({BASE_URL}/student-info?id={user_profile.get("user_id")})
+ :kirby_fly: Want a **more personalized** advising experience? Just share a bit more info using [this link]({base_url}/student-info?id={user_id})
 No pressure though - it's **totally optional**, and you're free to continue without it!
 
  :kirby_type: To speak with a human advisor, just type: \"**talk to a human advisor**\" or click on the \"**Connect**\" button.
 """
-    transcript = user_profile.get("transcript")
-    
-    def format_student_courses():
-        if transcript:
-            courses = transcript.get("completed_courses")
-            str = ""
-            for course in courses:
-                str += f"{course.get("course_id", "")} {course.get("course_name", "")}, Grade: {course.get("grade", "not provided")} "
-            return str
-        return "not provided"
-    
-    def is_international_student():
-        if transcript:
-            domestic = transcript.get("domestic", "")
-            if domestic == "false" or domestic == False:
-                return "international student"
-            elif domestic == "true" or domestic == True:
-                return "domestic student"
-            return "not provided"
-    
-    return f"""
+
+NO_CONVERSATION_SUMMARY = "none (this is an early conversation)"
+
+# condenses turns that fell out of the replayed history window (utils/history.py)
+CONVERSATION_SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a Tufts MSCS graduate student and an advising bot.
+You are given the previous summary and the newest turns. Return an updated summary, in plain text with no
+preamble, of at most 150 words: the topics the student asked about, facts they shared about themselves
+(program, courses, GPA, visa status, plans), answers they were given, and anything still unresolved.
+Drop greetings and small talk. Do not invent details.
+"""
+
+# reply to a plain thank-you or goodbye that never reached the model
+FAREWELL_RESPONSE = " :kirby: You're very welcome! Come back any time you have more questions about the MSCS program."
+
+SYSTEM_PROMPT_TEMPLATE = """
 # TUFTS MSCS ACADEMIC ADVISOR BOT
 
 You are an academic advisor specializing in the MSCS (Master of Science in Computer Science) program at Tufts University. 
@@ -84,12 +88,13 @@ Step 1. Identify the correct **response category** based on student message:
         - Examples: acknowledgments, thanks, closing messages
 2. Respond to student's question or message:
     - when applicable, **personalize** your answer based on the student's known context:
-       - Program: {transcript.get("program", "not provided")}
-        - Completed coursework: {format_student_courses()}
-        - GPA (if provided): {transcript.get("GPA", "not provided")}
-        - Visa status (international/domestic): {is_international_student()}
-        - total credits earned: {transcript.get("credits_earned", "not provided")}
+       - Program: {program}
+        - Completed coursework: {completed_courses}
+        - GPA (if provided): {gpa}
+        - Visa status (international/domestic): {visa_status}
+        - total credits earned: {credits_earned}
         - Any previous questions students asked, or your previous answers
+        - Summary of the earlier conversation (older than the messages you can see): {conversation_summary}
     - Evaluate whether more student info is needed to provide an accurate and helpful answer.
         - This is especially important when the student is asking a personalized question, such as when their question includes words like "I" or "my", which indicate the question is about their specific situation.
         - Example: If the student asks, "How many courses do I still need to take to fulfill my graduation requirement?" but hasn't shared which courses they've already completed — you should request that information.
@@ -246,28 +251,7 @@ Step 1. Identify the correct **response category** based on student message:
 
 """
 
-def get_escalated_response(user_profile):
-    transcript = user_profile.get("transcript", {})
-
-    def format_student_courses():
-        if transcript:
-            courses = transcript.get("completed_courses")
-            str = ""
-            for course in courses:
-                str += f"{course.get("course_id", "")} {course.get("course_name", "")}, Grade: {course.get("grade", "not provided")} "
-            return str
-        return "not provided"
-    
-    def is_international_student():
-        if transcript:
-            domestic = transcript.get("domestic", "")
-            if domestic == "false" or domestic == False:
-                return "international student"
-            elif domestic == "true" or domestic == True:
-                return "domestic student"
-            return "not provided"
-        
-    return f"""# TUFTS MSCS ACADEMIC ADVISOR BOT
+ESCALATED_PROMPT_TEMPLATE = """# TUFTS MSCS ACADEMIC ADVISOR BOT
 
 You are an academic advisor specializing in the MSCS (Master of Science in Computer Science) program at Tufts University. 
 Your role is to **accurately and professionally answer CS advising-related questions** for graduate students (MS and PhD).
@@ -278,12 +262,13 @@ Your role is to **accurately and professionally answer CS advising-related quest
 
 For every student message or question:
     - when applicable, **personalize** your answer based on the student's known context:
-        - Program: {transcript.get("program", "not provided")}
-        - Completed coursework: {format_student_courses()}
-        - GPA (if provided): {transcript.get("GPA", "not provided")}
-        - Visa status (international/domestic): {is_international_student()}
-        - total credits earned: {transcript.get("credits_earned", "not provided")}
+        - Program: {program}
+        - Completed coursework: {completed_courses}
+        - GPA (if provided): {gpa}
+        - Visa status (international/domestic): {visa_status}
+        - total credits earned: {credits_earned}
         - Any previous questions students asked, or your previous answers
+        - Summary of the earlier conversation (older than the messages you can see): {conversation_summary}
     - Generate a **properly formatted JSON response** strictly following to the guidelines defined below:
         - in "llmAnswer" field
             - Provide your most complete and thoughtful attempt at answering the question using provided resources
@@ -306,6 +291,136 @@ For every student message or question:
     - **MAKE SURE YOUR FINAL OUTPUT IS A VALID JSON OBJECT**
 """
 
+
+def compile_template(template):
+    """
+    Split a str.format-style template into literal chunks and field names once.
+
+    Returns:
+        tuple: (list of literal chunks, list of field names); there is always one
+        more literal chunk than there are fields
+    """
+    literals, fields = [], []
+    pending = []
+    for literal, field, _, _ in Formatter().parse(template):
+        pending.append(literal)
+        if field is not None:
+            literals.append("".join(pending))
+            pending = []
+            fields.append(field)
+    literals.append("".join(pending))
+    return literals, fields
+
+
+def render_template(compiled, values):
+    """
+    Render a compiled template with a dict of field values in one join.
+    """
+    literals, fields = compiled
+    parts = [literals[0]]
+    for field, literal in zip(fields, literals[1:]):
+        parts.append(values[field])
+        parts.append(literal)
+    return "".join(parts)
+
+
+_GREETING = compile_template(GREETING_TEMPLATE)
+_SYSTEM_PROMPT = compile_template(SYSTEM_PROMPT_TEMPLATE)
+_ESCALATED_PROMPT = compile_template(ESCALATED_PROMPT_TEMPLATE)
+
+# user_id -> (transcript hash, rendered per-student section)
+_student_sections = LRUCache(maxsize=PROMPT_CACHE_SIZE)
+
+
+def transcript_hash(transcript):
+    """
+    Stable hash of a transcript, used to detect profile changes between messages.
+    """
+    payload = json.dumps(transcript, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def format_student_courses(transcript):
+    if transcript:
+        courses = transcript.get("completed_courses") or []
+        return "".join(
+            f"{course.get('course_id', '')} {course.get('course_name', '')}, Grade: {course.get('grade', 'not provided')} "
+            for course in courses
+        )
+    return "not provided"
+
+
+def is_international_student(transcript):
+    if transcript:
+        domestic = transcript.get("domestic", "")
+        if domestic == "false" or domestic == False:
+            return "international student"
+        elif domestic == "true" or domestic == True:
+            return "domestic student"
+    return "not provided"
+
+
+def get_student_section(user_profile):
+    """
+    Return the rendered per-student values of the prompts, cached per student.
+
+    The cache entry is keyed by user_id and carries the transcript hash, so a
+    changed transcript is re-rendered even before invalidate_student_prompt runs.
+    """
+    user_id = user_profile.get("user_id")
+    transcript = user_profile.get("transcript") or {}
+    digest = transcript_hash(transcript)
+
+    cached = _student_sections.get(user_id)
+    if cached and cached[0] == digest:
+        return cached[1]
+
+    section = {
+        "program": str(transcript.get("program", "not provided")),
+        "completed_courses": format_student_courses(transcript),
+        "gpa": str(transcript.get("GPA", "not provided")),
+        "visa_status": is_international_student(transcript),
+        "credits_earned": str(transcript.get("credits_earned", "not provided")),
+        "greeting_msg": render_template(_GREETING, {"base_url": BASE_URL, "user_id": str(user_id)})
+    }
+    _student_sections.set(user_id, (digest, section))
+    return section
+
+
+def invalidate_student_prompt(user_id):
+    """
+    Drop the cached prompt section of a student, e.g. after their transcript was updated.
+    """
+    _student_sections.pop(user_id)
+
+
+def _prompt_values(user_profile):
+    # the conversation summary changes between messages, so it is not part of the cached section
+    values = dict(get_student_section(user_profile))
+    values["conversation_summary"] = user_profile.get("history_summary") or NO_CONVERSATION_SUMMARY
+    return values
+
+
+def get_system_prompt(user_profile):
+    return render_template(_SYSTEM_PROMPT, _prompt_values(user_profile))
+
+
+def get_escalated_response(user_profile):
+    return render_template(_ESCALATED_PROMPT, _prompt_values(user_profile))
+
+def get_greeting_response(user_profile):
+    """
+    The category 1 reply, rendered locally exactly as the system prompt asks the model to return it.
+    """
+    return " :kirby_say_hi: Welcome to the **Tufts MSCS Advising Bot**! " + get_student_section(user_profile)["greeting_msg"]
+
+
+def get_farewell_response():
+    """
+    Canned category 7 reply for a plain thank-you or goodbye.
+    """
+    return FAREWELL_RESPONSE
+
 def main():
     """Example usage of the system prompt"""
     system_prompt = get_system_prompt()
@@ -0,0 +1,327 @@
+# utils/corpus.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from llmproxy import retrieve
+from utils.mongo_config import get_collection
+from utils.uploads import HANDBOOK_REFERENCES, HANDBOOK_UPLOAD_FORMAT, RESOURCES_DIR, reference_upload
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = "cs-advising-handbooks-shared-"
+STALE_UPLOAD_SECONDS = 600  # Reclaim an "uploading" claim left behind by a crashed worker
+READY_TIMEOUT = int(os.environ.get("CORPUS_READY_TIMEOUT", "180"))  # Give up polling the proxy index after this
+RETRY_AFTER = 60  # Seconds before a failed ingestion is attempted again
+POLL_INTERVAL_MIN = 0.25
+POLL_INTERVAL_MAX = 2.0
+READINESS_PROBE = "Tufts computer science graduate handbook"
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Hash a file's contents in fixed-size blocks.
+
+    Returns:
+        str: hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusManager:
+    """
+    Uploads the handbook PDFs once into a shared, content-addressed LLMProxy session.
+
+    The session id is derived from the hashes of every resource file, so all
+    students retrieve from the same corpus and a new upload only happens when
+    a handbook actually changes. Upload state is recorded in the corpus.files
+    collection, which also lets several gunicorn workers agree on who uploads.
+    Ingestion runs on a background thread: files are uploaded concurrently and
+    the session is polled until retrieval returns chunks, so nothing on the
+    request path sleeps waiting for the proxy to finish indexing.
+    Per-user sessions no longer hold documents; they only keep conversation
+    history and query the shared session for handbook context.
+    """
+
+    def __init__(self, references=HANDBOOK_REFERENCES, resources_dir=RESOURCES_DIR):
+        self.references = list(references)
+        self.resources_dir = resources_dir
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._session_id = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._failed_at = None
+        self._state = {"status": "idle", "files": {}}
+
+    def file_hashes(self):
+        """
+        Return {reference: sha256} for every resource file, hashing on first use.
+        """
+        if self._hashes is None:
+            self._hashes = {
+                reference: file_sha256(os.path.join(self.resources_dir, reference))
+                for reference in self.references
+            }
+        return self._hashes
+
+    @property
+    def session_id(self):
+        """
+        Shared session id for the current contents of the resource files.
+        """
+        if self._session_id is None:
+            hashes = self.file_hashes()
+            contents = "".join(f"{name}:{hashes[name]}" for name in sorted(hashes))
+            if HANDBOOK_UPLOAD_FORMAT != "pdf":
+                # text uploads are chunked differently, so they get their own session
+                contents += f":{HANDBOOK_UPLOAD_FORMAT}"
+            fingerprint = hashlib.sha256(contents.encode("utf-8")).hexdigest()
+            self._session_id = SESSION_PREFIX + fingerprint[:16]
+        return self._session_id
+
+    def _claim(self, collection, reference, sha256):
+        """
+        Atomically claim the upload of one file, returning True if this worker owns it.
+        """
+        key = f"{self.session_id}:{reference}"
+        now = datetime.now(timezone.utc)
+        result = collection.update_one(
+            {"_id": key},
+            {"$setOnInsert": {
+                "session_id": self.session_id,
+                "reference": reference,
+                "sha256": sha256,
+                "status": "uploading",
+                "claimed_at": now
+            }},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            return True
+
+        # retry failed uploads and claims abandoned by a crashed worker
+        stale = datetime.fromtimestamp(time.time() - STALE_UPLOAD_SECONDS, timezone.utc)
+        result = collection.update_one(
+            {"_id": key, "$or": [
+                {"status": "failed"},
+                {"status": "uploading", "claimed_at": {"$lt": stale}}
+            ]},
+            {"$set": {"status": "uploading", "claimed_at": now}}
+        )
+        return result.modified_count == 1
+
+    def _ingest_file(self, collection, reference, sha256):
+        """
+        Upload one file unless it is already recorded for the shared session.
+
+        Returns:
+            str: "uploaded", "skipped", "waiting" (another worker owns it) or "failed"
+        """
+        key = f"{self.session_id}:{reference}"
+        self._set_file_state(reference, "uploading")
+        if collection is not None:
+            if collection.count_documents({"_id": key, "status": "uploaded"}, limit=1):
+                self._set_file_state(reference, "uploaded")
+                return "skipped"
+            if not self._claim(collection, reference, sha256):
+                self._set_file_state(reference, "waiting")
+                return "waiting"
+
+        ok = reference_upload(reference, self.session_id)
+        if collection is not None:
+            collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "status": "uploaded" if ok else "failed",
+                    "uploaded_at": datetime.now(timezone.utc)
+                }}
+            )
+        self._set_file_state(reference, "uploaded" if ok else "failed")
+        return "uploaded" if ok else "failed"
+
+    def _wait_for_other_workers(self, collection, references):
+        """
+        Poll corpus.files until uploads claimed by other workers finish.
+        """
+        keys = [f"{self.session_id}:{reference}" for reference in references]
+        deadline = time.monotonic() + STALE_UPLOAD_SECONDS
+        while time.monotonic() < deadline:
+            done = collection.count_documents({"_id": {"$in": keys}, "status": "uploaded"})
+            if done == len(keys):
+                for reference in references:
+                    self._set_file_state(reference, "uploaded")
+                return True
+            if collection.count_documents({"_id": {"$in": keys}, "status": "failed"}, limit=1):
+                return False
+            time.sleep(POLL_INTERVAL_MAX)
+        return False
+
+    def _is_queryable(self):
+        """
+        Probe the shared session: it is ready once retrieval returns any chunk.
+        """
+        rag_context = retrieve(query=READINESS_PROBE, session_id=self.session_id, rag_threshold=0.0, rag_k=1)
+        return isinstance(rag_context, list) and len(rag_context) > 0
+
+    def _ingest(self):
+        collection = get_collection("corpus", "files")
+        sessions = get_collection("corpus", "sessions")
+        try:
+            if sessions is not None and sessions.count_documents({"_id": self.session_id, "status": "ready"}, limit=1):
+                self._mark_ready()
+                return
+
+            # upload every handbook concurrently instead of one after another
+            self._set_status("uploading")
+            hashes = self.file_hashes()
+            with ThreadPoolExecutor(max_workers=len(hashes)) as pool:
+                results = dict(zip(hashes, pool.map(
+                    lambda item: self._ingest_file(collection, *item), hashes.items()
+                )))
+
+            if "failed" in results.values():
+                raise RuntimeError(f"upload failed: {results}")
+            waiting = [reference for reference, result in results.items() if result == "waiting"]
+            if waiting and not self._wait_for_other_workers(collection, waiting):
+                raise RuntimeError(f"uploads by other workers did not finish: {waiting}")
+
+            # the proxy indexes uploads asynchronously; poll until retrieval works
+            self._set_status("indexing")
+            delay = POLL_INTERVAL_MIN
+            deadline = time.monotonic() + READY_TIMEOUT
+            while not self._is_queryable():
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"session not queryable after {READY_TIMEOUT}s")
+                time.sleep(delay)
+                delay = min(delay * 2, POLL_INTERVAL_MAX)
+
+            if sessions is not None:
+                sessions.update_one(
+                    {"_id": self.session_id},
+                    {"$set": {"status": "ready", "ready_at": datetime.now(timezone.utc)}},
+                    upsert=True
+                )
+            self._mark_ready()
+        except Exception as e:
+            logger.error(f"Corpus ingestion for {self.session_id} failed: {str(e)}")
+            with self._lock:
+                self._state["status"] = "failed"
+                self._state["error"] = str(e)
+                self._failed_at = time.monotonic()
+
+    def _set_status(self, status):
+        with self._lock:
+            self._state["status"] = status
+
+    def _set_file_state(self, reference, status):
+        with self._lock:
+            self._state["files"][reference] = status
+
+    def _mark_ready(self):
+        with self._lock:
+            self._state["status"] = "ready"
+            self._state["ready_at"] = time.time()
+            for reference in self.references:
+                self._state["files"].setdefault(reference, "uploaded")
+        self._ready.set()
+        logger.info(f"corpus session {self.session_id} is ready")
+
+    def start_ingestion(self):
+        """
+        Kick off background upload and indexing of the shared corpus.
+
+        Safe to call on every request: it returns immediately when ingestion is
+        running or finished, and only retries a failed run after RETRY_AFTER seconds.
+        """
+        with self._lock:
+            if self._ready.is_set():
+                return
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER:
+                return
+            self._failed_at = None
+            self._state = {"status": "starting", "files": {}, "started_at": time.time()}
+            self._thread = threading.Thread(target=self._ingest, name="corpus-ingest", daemon=True)
+            self._thread.start()
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Block until the shared corpus is queryable or the timeout expires.
+
+        Returns:
+            bool: True if the corpus is ready
+        """
+        return self._ready.wait(timeout)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def nearly_ready(self):
+        """
+        Tell whether a short wait is likely to end with the session ready:
+        every upload is done and only the proxy's indexing is left. Uploads
+        take far longer, and a failed run is not retried for RETRY_AFTER.
+        """
+        with self._lock:
+            return self._state["status"] == "indexing"
+
+    def retrieve(self, query, rag_threshold=0.5, rag_k=5):
+        """
+        Retrieve handbook chunks for the query from the shared session.
+
+        Returns:
+            list: LLMProxy rag_context entries, or an error string
+        """
+        return retrieve(query=query, session_id=self.session_id, rag_threshold=rag_threshold, rag_k=rag_k)
+
+    def get_state(self):
+        """
+        Report ingestion progress of the shared session for monitoring.
+        """
+        with self._lock:
+            state = dict(self._state)
+            state["files"] = dict(self._state["files"])
+        state["session_id"] = self.session_id
+        return state
+
+    def refresh(self):
+        """
+        Re-hash the resource files, e.g. after a handbook was replaced on disk,
+        and re-ingest if their contents changed.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._hashes = None
+            previous, self._session_id = self._session_id, None
+        if self.session_id != previous:
+            self._ready.clear()
+            with self._lock:
+                self._failed_at = None
+            self.start_ingestion()
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus_manager():
+    """
+    Return the process-wide corpus manager.
+    """
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                _corpus = CorpusManager()
+    return _corpus
@@ -6,7 +6,10 @@ Handles sending email notifications to human advisors.
 """
 
 import logging
+import queue
 import smtplib
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
@@ -16,67 +19,330 @@ import os
 load_dotenv()
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")  # Default to Gmail
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))  # Default to TLS port
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"  # Disable for a local stand-in server
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "30"))
 EMAIL_USER = os.environ.get("EMAIL_USER")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
 ADVISOR_EMAIL = os.environ.get("ADVISOR_EMAIL")
 
+# Outbound queue settings
+EMAIL_QUEUE_SIZE = int(os.environ.get("EMAIL_QUEUE_SIZE", "1000"))  # Messages held before new ones are dropped
+EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", "20"))  # Messages sent per connection check
+EMAIL_BATCH_WINDOW = float(os.environ.get("EMAIL_BATCH_WINDOW", "0.5"))  # Seconds to wait for a burst to fill a batch
+EMAIL_MAX_RETRIES = int(os.environ.get("EMAIL_MAX_RETRIES", "5"))
+EMAIL_BACKOFF_FACTOR = float(os.environ.get("EMAIL_BACKOFF_FACTOR", "1.0"))  # Sleeps 1s, 2s, 4s, ... between retries
+EMAIL_IDLE_TIMEOUT = float(os.environ.get("EMAIL_IDLE_TIMEOUT", "60"))  # Close the SMTP connection after this long unused
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# errors worth retrying on a fresh connection; anything else is a rejected message
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+_STOP = object()  # queued by close() to wake the sender thread
+
+
+def _is_transient(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 4xx replies are temporary by definition
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class EmailQueue:
+    """
+    Outbound email queue drained by one background sender thread.
+
+    The sender keeps a single authenticated SMTP connection open and reuses
+    it for every message, so the STARTTLS/login handshake is paid once per
+    burst instead of once per email. Messages that arrive close together are
+    sent as a batch, transient failures are retried with exponential backoff
+    on a fresh connection, and the connection is closed after sitting idle.
+    """
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, user=EMAIL_USER, password=EMAIL_PASSWORD,
+                 starttls=SMTP_STARTTLS, maxsize=EMAIL_QUEUE_SIZE, batch_size=EMAIL_BATCH_SIZE,
+                 batch_window=EMAIL_BATCH_WINDOW, max_retries=EMAIL_MAX_RETRIES,
+                 backoff_factor=EMAIL_BACKOFF_FACTOR, idle_timeout=EMAIL_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.idle_timeout = idle_timeout
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._server = None
+        self._last_used = 0.0
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0,
+                       "retries": 0, "batches": 0, "connections": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="email-sender", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, msg):
+        """
+        Queue a message for delivery without blocking the caller.
+
+        Returns:
+            bool: False if the queue is full and the message was dropped
+        """
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            self._count("dropped")
+            logger.error(f"Email queue is full, dropping message: {msg['Subject']}")
+            return False
+        self._count("queued")
+        return True
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            server.starttls()
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        self._count("connections")
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return server
+
+    def _disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            try:
+                self._server.close()
+            except Exception:
+                pass
+        self._server = None
+
+    def _reset_after(self, error):
+        if isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)) \
+                and not isinstance(error, smtplib.SMTPConnectError) and self._server is not None:
+            # the server answered, so the session is still usable once reset
+            try:
+                self._server.rset()
+                return
+            except Exception:
+                pass
+        self._disconnect()
+
+    def _get_server(self):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            # the server has most likely dropped us by now
+            self._disconnect()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def _next_batch(self):
+        try:
+            msg = self._queue.get(timeout=self.idle_timeout)
+        except queue.Empty:
+            self._disconnect()
+            return []
+        if msg is _STOP:
+            self._queue.task_done()
+            return []
+        batch = [msg]
+
+        # give a burst a moment to arrive so it goes out together
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                msg = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if msg is _STOP:
+                self._queue.task_done()
+                break
+            batch.append(msg)
+        return batch
+
+    def _deliver(self, msg):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._get_server().send_message(msg)
+                self._last_used = time.monotonic()
+                self._count("sent")
+                return True
+            except Exception as e:
+                self._reset_after(e)
+                if not _is_transient(e) or attempt == self.max_retries or self._stopping.is_set():
+                    self._count("failed")
+                    logger.error(f"Failed to send email notification: {str(e)}")
+                    return False
+                delay = self.backoff_factor * (2 ** attempt)
+                self._count("retries")
+                logger.warning(f"SMTP send failed ({str(e)}), retrying in {delay:.1f}s")
+                self._stopping.wait(delay)
+        return False
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._count("batches")
+            for msg in batch:
+                self._deliver(msg)
+                self._queue.task_done()
+        self._disconnect()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued message has been sent or given up on.
+
+        Returns:
+            bool: True if the queue drained within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def get_stats(self):
+        """
+        Report queue depth and delivery counters for monitoring.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        stats["connected"] = self._server is not None
+        return stats
+
+    def close(self, timeout=10):
+        """
+        Send what is still queued (up to timeout), then stop the sender thread.
+        """
+        self.flush(timeout)
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            try:
+                # wake the sender if it is waiting for new messages
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            thread.join(timeout=timeout)
+
+
+_email_queue = None
+_email_queue_lock = threading.Lock()
+
+
+def get_email_queue():
+    """
+    Return the process-wide outbound email queue, creating it on first use.
+    """
+    global _email_queue
+    if _email_queue is None:
+        with _email_queue_lock:
+            if _email_queue is None:
+                _email_queue = EmailQueue()
+    return _email_queue
+
+
+def close_email_queue():
+    """
+    Deliver pending emails and close the SMTP connection (call on shutdown).
+    """
+    global _email_queue
+    with _email_queue_lock:
+        if _email_queue is not None:
+            _email_queue.close()
+            _email_queue = None
+
+
+def build_notification_email(student_username, student_question, llm_answer, is_initial_escalation):
+    """
+    Build the advisor notification message.
+
+    Returns:
+        MIMEMultipart or None: None when there is nothing to send for this kind of message
+    """
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_USER
+    msg['To'] = ADVISOR_EMAIL
+
+    if is_initial_escalation:
+        msg['Subject'] = f"🚨 ALERT: New CS Advising Escalation from {student_username}"
+        body = f"""
+        <html>
+        <body>
+            <h2>New Escalation Alert</h2>
+            <p>Student <b>{student_username}</b> has requested help that requires your attention.</p>
+            <h3>Student question:</h3>
+            <p>{student_question}</p>
+            <h3>AI-Generated Response:</h3>
+            <p>{llm_answer}</p>
+            <p>Please log in to RocketChat to respond to this message.</p>
+            <hr>
+            <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
+        </body>
+        </html>
+        """
+    # else:
+    #     msg['Subject'] = f"💬 New Thread Message from {student_username}"
+    #     body = f"""
+    #     <html>
+    #     <body>
+    #         <h2>New Message in Existing Thread</h2>
+    #         <p>Student <b>{student_username}</b> has sent a new message in an active thread.</p>
+    #         <h3>Message Content:</h3>
+    #         <p>{message_text}</p>
+    #         <p>Please log in to RocketChat to continue the conversation.</p>
+    #         <hr>
+    #         <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
+    #     </body>
+    #     </html>
+    #     """
+    else:
+        return None
+
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
 
 def send_notification_email(student_username, student_question, llm_answer, is_initial_escalation):
+    """
+    Queue an advisor notification; delivery happens on the background sender
+    so the caller never waits on the SMTP handshake.
+    """
     if not all([EMAIL_USER, EMAIL_PASSWORD, ADVISOR_EMAIL]):
         logger.warning("Email credentials not configured. Skipping email notification.")
         return
-    
+
     try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = ADVISOR_EMAIL
-        
-        if is_initial_escalation:
-            msg['Subject'] = f"🚨 ALERT: New CS Advising Escalation from {student_username}"
-            body = f"""
-            <html>
-            <body>
-                <h2>New Escalation Alert</h2>
-                <p>Student <b>{student_username}</b> has requested help that requires your attention.</p>
-                <h3>Student question:</h3>
-                <p>{student_question}</p>
-                <h3>AI-Generated Response:</h3>
-                <p>{llm_answer}</p>
-                <p>Please log in to RocketChat to respond to this message.</p>
-                <hr>
-                <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
-            </body>
-            </html>
-            """
-        # else:
-        #     msg['Subject'] = f"💬 New Thread Message from {student_username}"
-        #     body = f"""
-        #     <html>
-        #     <body>
-        #         <h2>New Message in Existing Thread</h2>
-        #         <p>Student <b>{student_username}</b> has sent a new message in an active thread.</p>
-        #         <h3>Message Content:</h3>
-        #         <p>{message_text}</p>
-        #         <p>Please log in to RocketChat to continue the conversation.</p>
-        #         <hr>
-        #         <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
-        #     </body>
-        #     </html>
-        #     """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Connect to server and send
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        
-        logger.info(f"Email notification sent to advisor for message from {student_username}")
-        
+        msg = build_notification_email(student_username, student_question, llm_answer, is_initial_escalation)
+        if msg is None:
+            return
+        if get_email_queue().enqueue(msg):
+            logger.info(f"Email notification queued for advisor for message from {student_username}")
     except Exception as e:
-        logger.error(f"Failed to send email notification: {str(e)}")
+        logger.error(f"Failed to queue email notification: {str(e)}")
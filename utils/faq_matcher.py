@@ -0,0 +1,223 @@
+# utils/faq_matcher.py
+import logging
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from utils.faq_version import read_faq_version
+from utils.mongo_config import get_collection
+from utils.response_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = int(os.environ.get("FAQ_MATCH_FEATURES", "4096"))  # Hashed vector width
+MATCH_THRESHOLD = float(os.environ.get("FAQ_MATCH_THRESHOLD", "0.8"))  # Minimum cosine to reuse an FAQ answer
+VERSION_CHECK_INTERVAL = 30  # Seconds between checks for edits made by other workers
+
+# words that carry no meaning for matching advising questions
+STOP_WORDS = frozenset("""
+a an and are as at be can could do does for from how i if in is it me my of on or
+should the there to what when where which who will with would you your
+""".split())
+
+
+def _features(text):
+    """
+    Hash a question into feature indices: words, word bigrams and character
+    trigrams of each word (so "prereqs" still lands near "prerequisites").
+    """
+    words = [word for word in normalize_question(text).split() if word not in STOP_WORDS]
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    # crc32 is stable across processes, unlike the built-in salted hash()
+    return [zlib.crc32(feature.encode("utf-8")) % N_FEATURES for feature in features]
+
+
+def tf_vector(text):
+    vector = np.zeros(N_FEATURES, dtype=np.float32)
+    indices = _features(text)
+    if indices:
+        np.add.at(vector, indices, 1.0)
+        np.log1p(vector, out=vector)  # sublinear term frequency
+    return vector
+
+
+class FAQMatcher:
+    """
+    In-process semantic matcher over freq_questions.questions.
+
+    Each FAQ question is stored as a hashed, log-scaled term-frequency row in
+    a NumPy matrix. IDF weights come from document frequencies that are kept
+    up to date as FAQs are added, edited or deleted, so a single change costs
+    O(features) instead of a rebuild. A query is answered with one vectorized
+    cosine similarity over the whole matrix.
+    """
+
+    def __init__(self, threshold=MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()  # one version check/reload at a time
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+        self._reset()
+
+    def _reset(self):
+        self._tf = np.zeros((64, N_FEATURES), dtype=np.float32)
+        self._df = np.zeros(N_FEATURES, dtype=np.float32)
+        self._docs = []  # row -> FAQ fields, None for free rows
+        self._rows = {}  # str(_id) -> row
+        self._free = []
+        self._count = 0
+
+    def _idf(self):
+        return np.log((1.0 + self._count) / (1.0 + self._df)) + 1.0
+
+    def load(self):
+        """
+        (Re)build the index from the FAQ collection.
+        """
+        collection = get_collection("freq_questions", "questions")
+        if collection is None:
+            return
+        version = read_faq_version()
+        cursor = collection.find(
+            {"question": {"$exists": True}},
+            {"question": 1, "question_id": 1, "answer": 1, "suggestedQuestions": 1}
+        )
+        with self._lock:
+            self._reset()
+            for doc in cursor:
+                self._add(doc)
+            self._loaded = True
+            self._version = version
+            self._checked_at = time.monotonic()
+        logger.info(f"FAQ matcher indexed {self._count} questions")
+
+    def _ensure_current(self):
+        if self._loaded and time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        with self._refresh_lock:
+            # re-check: a concurrent request may have loaded or checked meanwhile
+            if not self._loaded:
+                self.load()
+                return
+            now = time.monotonic()
+            if now - self._checked_at < VERSION_CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            version = read_faq_version()
+            if version is not None and version != self._version:
+                self.load()
+
+    def _add(self, doc):
+        if not doc.get("question"):
+            return
+        tf = tf_vector(doc["question"])
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = len(self._docs)
+            if row == self._tf.shape[0]:
+                self._tf = np.vstack([self._tf, np.zeros_like(self._tf)])
+            self._docs.append(None)
+
+        self._tf[row] = tf
+        self._df += tf > 0
+        self._docs[row] = {
+            "question": doc.get("question"),
+            "question_id": doc.get("question_id"),
+            "answer": doc.get("answer"),
+            "suggestedQuestions": doc.get("suggestedQuestions") or []
+        }
+        self._rows[str(doc["_id"])] = row
+        self._count += 1
+
+    def _remove(self, doc_id):
+        row = self._rows.pop(str(doc_id), None)
+        if row is None:
+            return
+        self._df -= self._tf[row] > 0
+        self._tf[row] = 0.0
+        self._docs[row] = None
+        self._free.append(row)
+        self._count -= 1
+
+    def upsert(self, doc):
+        """
+        Add or replace one FAQ document (must include _id) in the index.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(doc["_id"])
+            self._add(doc)
+
+    def remove(self, doc_id):
+        """
+        Drop one FAQ document from the index.
+        """
+        with self._lock:
+            if self._loaded:
+                self._remove(doc_id)
+
+    def sync_version(self, version):
+        """
+        Record a FAQ version bump made by this worker so it does not trigger a reload.
+        """
+        with self._lock:
+            self._version = version
+
+    def top_k(self, query, k=3):
+        """
+        Return up to k (score, faq) pairs ordered by cosine similarity.
+        """
+        self._ensure_current()
+        with self._lock:
+            if self._count == 0:
+                return []
+            n = len(self._docs)
+            idf = self._idf()
+            idf_sq = idf * idf
+
+            query_tf = tf_vector(query)
+            query_norm = float(np.linalg.norm(query_tf * idf))
+            if query_norm == 0.0:
+                return []
+
+            matrix = self._tf[:n]
+            doc_norms = np.sqrt((matrix * matrix) @ idf_sq)
+            scores = (matrix @ (query_tf * idf_sq)) / (np.maximum(doc_norms, 1e-9) * query_norm)
+
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[row]), self._docs[row]) for row in top if self._docs[row] is not None]
+
+    def match(self, query):
+        """
+        Return the best FAQ and its score if it clears the confidence threshold.
+
+        Returns:
+            tuple: (faq dict, score) or (None, best score)
+        """
+        results = self.top_k(query, k=1)
+        if not results:
+            return None, 0.0
+        score, faq = results[0]
+        if score >= self.threshold:
+            return faq, score
+        return None, score
+
+    def get_stats(self):
+        with self._lock:
+            return {"questions": self._count, "threshold": self.threshold, "version": self._version}
+
+
+faq_matcher = FAQMatcher()
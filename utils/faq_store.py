@@ -0,0 +1,399 @@
+# utils/faq_store.py
+import csv
+import io
+import json
+import logging
+import os
+import threading
+
+from pymongo import ASCENDING, DESCENDING, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = int(os.environ.get("FAQ_PAGE_SIZE", "50"))  # FAQs per /faqs page
+MAX_PAGE_SIZE = 500
+IMPORT_BATCH_SIZE = int(os.environ.get("FAQ_IMPORT_BATCH_SIZE", "500"))  # Rows per bulk_write
+MAX_REPORTED_ERRORS = 50
+
+# column order for CSV import/export
+EXPORT_FIELDS = ["question_id", "question", "answer", "suggestedQuestions"]
+
+# fields the /faqs list and edit forms render
+LIST_PROJECTION = {"question_id": 1, "question": 1, "answer": 1, "suggestedQuestions": 1}
+
+# the counter lives next to the FAQ version in freq_questions.meta
+QUESTION_ID_COUNTER = "question_id"
+
+_seeded = False
+_seed_lock = threading.Lock()
+
+
+def _questions():
+    return get_collection("freq_questions", "questions")
+
+
+def _meta():
+    return get_collection("freq_questions", "meta")
+
+
+def reserve_question_ids(highest_id):
+    """
+    Make sure the allocator never hands out an ID at or below highest_id.
+
+    Used to seed the counter from existing data and after bulk inserts that
+    bring their own question_ids. $max makes it safe to call concurrently.
+    """
+    _meta().update_one(
+        {"_id": QUESTION_ID_COUNTER},
+        {"$max": {"seq": int(highest_id)}},
+        upsert=True
+    )
+
+
+def _ensure_seeded():
+    """
+    Seed the counter from the highest existing question_id, once per process.
+
+    The lookup walks the question_id index backwards, so it reads one entry.
+    """
+    global _seeded
+    if _seeded:
+        return
+    with _seed_lock:
+        if _seeded:
+            return
+        top = _questions().find_one(
+            {"question_id": {"$type": "number"}},
+            {"question_id": 1},
+            sort=[("question_id", DESCENDING)]
+        )
+        reserve_question_ids(top["question_id"] if top else 0)
+        _seeded = True
+
+
+def next_question_id():
+    """
+    Atomically allocate the next question_id.
+
+    Returns:
+        int: an ID no other worker has been or will be given
+    """
+    _ensure_seeded()
+    doc = _meta().find_one_and_update(
+        {"_id": QUESTION_ID_COUNTER},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["seq"]
+
+
+def allocate_question_ids(count):
+    """
+    Atomically allocate a block of consecutive question_ids.
+
+    Returns:
+        range: the allocated IDs
+    """
+    if count <= 0:
+        return range(0)
+    _ensure_seeded()
+    doc = _meta().find_one_and_update(
+        {"_id": QUESTION_ID_COUNTER},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return range(doc["seq"] - count + 1, doc["seq"] + 1)
+
+
+def peek_next_question_id():
+    """
+    Return the ID the next added FAQ will most likely get, without allocating it.
+    """
+    _ensure_seeded()
+    doc = _meta().find_one({"_id": QUESTION_ID_COUNTER}, {"seq": 1})
+    return (doc or {}).get("seq", 0) + 1
+
+
+def list_faqs(search=None, after=None, before=None, limit=PAGE_SIZE):
+    """
+    Return one page of FAQs ordered by question_id.
+
+    Pages are keyed on question_id rather than skip/offset, so every page is
+    one index range scan no matter how deep it is. A search uses the text
+    index on question and answer.
+
+    Args:
+        search (str): optional text search terms
+        after (int): return the page that follows this question_id
+        before (int): return the page that precedes this question_id
+        limit (int): page size
+
+    Returns:
+        dict: documents (with string _id), and next_after / prev_before cursors
+        (None when there is no further page in that direction)
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = {}
+    if search:
+        query["$text"] = {"$search": search}
+
+    backwards = before is not None
+    if backwards:
+        query["question_id"] = {"$lt": before}
+    elif after is not None:
+        query["question_id"] = {"$gt": after}
+
+    # one extra document tells us whether another page exists
+    cursor = _questions().find(query, LIST_PROJECTION) \
+        .sort("question_id", DESCENDING if backwards else ASCENDING) \
+        .limit(limit + 1)
+    documents = list(cursor)
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    if backwards:
+        documents.reverse()
+
+    for doc in documents:
+        doc["_id"] = str(doc["_id"])
+
+    first_id = documents[0].get("question_id") if documents else None
+    last_id = documents[-1].get("question_id") if documents else None
+    if backwards:
+        next_after = last_id
+        prev_before = first_id if has_more else None
+    else:
+        next_after = last_id if has_more else None
+        prev_before = first_id if after is not None else None
+
+    return {
+        "documents": documents,
+        "next_after": next_after,
+        "prev_before": prev_before
+    }
+
+
+def count_faqs():
+    """
+    Return the (metadata-based, O(1)) number of FAQs.
+    """
+    return _questions().estimated_document_count()
+
+
+def _text_lines(stream):
+    """
+    Decode a binary upload stream line by line without reading it all into memory.
+    """
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def _parse_suggested(value):
+    if value is None or value == "":
+        return []
+    if isinstance(value, list):
+        return value
+    value = str(value).strip()
+    if value.startswith("["):
+        return json.loads(value)
+    # CSV cells may also hold "first question | second question"
+    return [part.strip() for part in value.split("|") if part.strip()]
+
+
+def validate_faq(row):
+    """
+    Check one imported row and normalize it into an FAQ document.
+
+    Returns:
+        dict: question, answer, suggestedQuestions and question_id (int or None)
+
+    Raises:
+        ValueError: describing the first problem with the row
+    """
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+
+    question = row.get("question")
+    answer = row.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question is required")
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError("answer is required")
+
+    question_id = row.get("question_id")
+    if question_id in (None, ""):
+        question_id = None
+    else:
+        try:
+            question_id = int(question_id)
+        except (TypeError, ValueError):
+            raise ValueError("question_id must be an integer")
+        if question_id <= 0:
+            raise ValueError("question_id must be positive")
+
+    try:
+        suggested = _parse_suggested(row.get("suggestedQuestions"))
+    except json.JSONDecodeError:
+        raise ValueError("suggestedQuestions must be a JSON list or |-separated text")
+    if not isinstance(suggested, list) or not all(isinstance(sq, str) for sq in suggested):
+        raise ValueError("suggestedQuestions must be a list of strings")
+
+    return {
+        "question_id": question_id,
+        "question": question.strip(),
+        "answer": answer.strip(),
+        "suggestedQuestions": [sq.strip() for sq in suggested if sq.strip()]
+    }
+
+
+def iter_import_rows(stream, fmt):
+    """
+    Yield (line number, raw row or parse error) from a JSONL or CSV upload, one line at a time.
+    """
+    lines = _text_lines(stream)
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ValueError(f"invalid JSON: {e.msg}")
+
+
+def _write_batch(batch):
+    """
+    Apply one batch of validated rows with a single ordered bulk_write.
+
+    Rows with a question_id replace that FAQ (or create it); rows without one
+    get IDs from one block allocation.
+    """
+    missing = [i for i, doc in enumerate(batch) if doc["question_id"] is None]
+    for i, question_id in zip(missing, allocate_question_ids(len(missing))):
+        batch[i]["question_id"] = question_id
+
+    missing = set(missing)
+    explicit = [doc["question_id"] for i, doc in enumerate(batch) if i not in missing]
+    if explicit:
+        # keep the allocator ahead of imported IDs
+        reserve_question_ids(max(explicit))
+
+    requests = []
+    for i, doc in enumerate(batch):
+        if i in missing:
+            requests.append(InsertOne(dict(doc)))
+        else:
+            fields = {key: value for key, value in doc.items() if key != "question_id"}
+            requests.append(UpdateOne({"question_id": doc["question_id"]}, {"$set": fields}, upsert=True))
+    return _questions().bulk_write(requests, ordered=True)
+
+
+def import_faqs(stream, fmt="jsonl", batch_size=IMPORT_BATCH_SIZE, on_batch=None):
+    """
+    Stream FAQs from a JSONL or CSV upload into freq_questions.questions.
+
+    Rows are validated as they are read and written in ordered bulk_write
+    batches. on_batch(question_ids) is called after every batch so FAQ-derived
+    caches are refreshed once per batch rather than once per row. Invalid rows
+    are skipped and reported; a write error stops the import.
+
+    Returns:
+        dict: counters, the first MAX_REPORTED_ERRORS row errors, and a write
+        error if one stopped the import
+    """
+    summary = {"rows": 0, "inserted": 0, "updated": 0, "upserted": 0,
+               "invalid": 0, "batches": 0, "errors": [], "write_error": None}
+
+    def record_error(line_no, message):
+        summary["invalid"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": line_no, "error": message})
+
+    def flush(batch):
+        try:
+            result = _write_batch(batch)
+        except BulkWriteError as e:
+            details = e.details or {}
+            summary["inserted"] += details.get("nInserted", 0)
+            summary["updated"] += details.get("nModified", 0)
+            summary["upserted"] += details.get("nUpserted", 0)
+            first = (details.get("writeErrors") or [{}])[0]
+            summary["write_error"] = first.get("errmsg", str(e))
+            logger.error(f"FAQ import stopped after a write error: {summary['write_error']}")
+            return False
+        summary["batches"] += 1
+        summary["inserted"] += result.inserted_count
+        summary["updated"] += result.modified_count
+        summary["upserted"] += result.upserted_count
+        if on_batch:
+            on_batch([doc["question_id"] for doc in batch])
+        return True
+
+    batch = []
+    for line_no, row in iter_import_rows(stream, fmt):
+        summary["rows"] += 1
+        if isinstance(row, Exception):
+            record_error(line_no, str(row))
+            continue
+        try:
+            batch.append(validate_faq(row))
+        except ValueError as e:
+            record_error(line_no, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            if not flush(batch):
+                return summary
+            batch = []
+
+    if batch:
+        flush(batch)
+    return summary
+
+
+def find_faqs_by_question_id(question_ids):
+    """
+    Return the FAQ documents with these question_ids (e.g. to refresh caches after an import).
+    """
+    return _questions().find({"question_id": {"$in": list(question_ids)}}, LIST_PROJECTION)
+
+
+def export_faqs(fmt="jsonl"):
+    """
+    Yield the FAQ collection as JSONL or CSV text, one document at a time.
+
+    The cursor is read in server-side batches, so the collection is never
+    held in memory.
+    """
+    cursor = _questions().find({}, LIST_PROJECTION).sort("question_id", ASCENDING).batch_size(IMPORT_BATCH_SIZE)
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for doc in cursor:
+            writer.writerow([
+                doc.get("question_id", ""),
+                doc.get("question", ""),
+                doc.get("answer", ""),
+                json.dumps(doc.get("suggestedQuestions") or [], ensure_ascii=False)
+            ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+
+    for doc in cursor:
+        yield json.dumps({field: doc.get(field) for field in EXPORT_FIELDS}, ensure_ascii=False) + "\n"
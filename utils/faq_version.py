@@ -0,0 +1,37 @@
+# utils/faq_version.py
+from pymongo import ReturnDocument
+
+from utils.mongo_config import get_collection
+
+# Shared counter bumped on every edit of freq_questions.questions, so each
+# worker process can tell when its in-memory FAQ-derived state is stale.
+
+
+def read_faq_version():
+    """
+    Return the current FAQ version, or None if the database is unavailable.
+    """
+    collection = get_collection("freq_questions", "meta")
+    if collection is None:
+        return None
+    doc = collection.find_one({"_id": "faq_version"}, {"version": 1})
+    return doc.get("version", 0) if doc else 0
+
+
+def bump_faq_version():
+    """
+    Increment the FAQ version after the collection changed.
+
+    Returns:
+        int or None: the new version
+    """
+    collection = get_collection("freq_questions", "meta")
+    if collection is None:
+        return None
+    doc = collection.find_one_and_update(
+        {"_id": "faq_version"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc.get("version") if doc else None
@@ -0,0 +1,389 @@
+# utils/handbook_index.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from utils.corpus import file_sha256, get_corpus_manager
+from utils.faq_matcher import STOP_WORDS
+from utils.metrics import timed
+from utils.text_store import STORE_FORMAT, get_text_store
+from utils.uploads import HANDBOOK_REFERENCES, RESOURCES_DIR
+
+logger = logging.getLogger(__name__)
+
+RAG_MODE = os.environ.get("RAG_MODE", "proxy").lower()  # "proxy" (LLMProxy session) or "local" (in-process BM25)
+INDEX_DIR = os.environ.get("HANDBOOK_INDEX_DIR", os.path.join(RESOURCES_DIR, "index"))
+CHUNK_WORDS = int(os.environ.get("HANDBOOK_CHUNK_WORDS", "180"))  # Words per chunk
+CHUNK_OVERLAP = int(os.environ.get("HANDBOOK_CHUNK_OVERLAP", "40"))  # Words shared by neighbouring chunks
+BM25_K1 = 1.5
+BM25_B = 0.75
+INDEX_FORMAT = 2  # Bump when the on-disk layout or chunking changes
+SESSION_PREFIX = "local-handbooks-"
+RETRY_AFTER = 60  # Seconds before a failed build is attempted again
+
+HANDBOOK_TITLES = {
+    "cs_handbook.pdf": "Tufts CS graduate course requirements",
+    "soe-grad-handbook.pdf": "Tufts SOE graduate handbook",
+    "filtered_grad_courses.pdf": "Tufts CS graduate course descriptions"
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_WORD = re.compile(rb"\S+")
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens without stop words; course numbers stay as tokens.
+    """
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def chunk_page(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Split one page's text into overlapping word windows.
+
+    Chunks never cross a page boundary, so each one cites a single page.
+
+    Yields:
+        tuple: (start, end) UTF-8 byte offsets of the chunk within the page
+    """
+    data = text.encode("utf-8")
+    words = [match.span() for match in _WORD.finditer(data)]
+    if not words:
+        return
+    step = max(1, chunk_words - overlap)
+    for first in range(0, max(len(words) - overlap, 1), step):
+        last = min(first + chunk_words, len(words)) - 1
+        yield words[first][0], words[last][1]
+
+
+class HandbookIndex:
+    """
+    In-process BM25 index over the handbook PDFs, used when RAG_MODE=local.
+
+    Chunks are byte ranges into the page-indexed text store, so the index
+    holds no text of its own: excerpts are sliced out of the memory-mapped
+    artifacts when a query needs them. The postings are stored as flat NumPy
+    arrays (CSR layout) under INDEX_DIR, keyed by the hashes of the source
+    files, so later starts only load two files and a handbook change
+    triggers a rebuild. A query touches only the postings of its own terms,
+    which keeps retrieval in the low milliseconds.
+
+    It exposes the same lifecycle as CorpusManager (start_ingestion,
+    wait_until_ready, session_id, get_state), so callers do not care which
+    backend answers.
+    """
+
+    def __init__(self, references=HANDBOOK_REFERENCES, resources_dir=RESOURCES_DIR, index_dir=INDEX_DIR):
+        self.references = list(references)
+        self.resources_dir = resources_dir
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._session_id = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._failed_at = None
+        self._state = {"status": "idle"}
+        self._vocab = {}
+        self._texts = []
+        self._doc_len = np.zeros(0, dtype=np.float32)
+
+    def file_hashes(self):
+        if self._hashes is None:
+            self._hashes = {
+                reference: file_sha256(os.path.join(self.resources_dir, reference))
+                for reference in self.references
+            }
+        return self._hashes
+
+    @property
+    def session_id(self):
+        """
+        Identifier for the current contents of the handbooks (and index format).
+        """
+        if self._session_id is None:
+            hashes = self.file_hashes()
+            fingerprint = hashlib.sha256(
+                (f"v{INDEX_FORMAT}.{STORE_FORMAT}:{CHUNK_WORDS}:{CHUNK_OVERLAP}:" +
+                 "".join(f"{name}:{hashes[name]}" for name in sorted(hashes))).encode("utf-8")
+            ).hexdigest()
+            self._session_id = SESSION_PREFIX + fingerprint[:16]
+        return self._session_id
+
+    def _paths(self):
+        base = os.path.join(self.index_dir, self.session_id)
+        return base + ".npz", base + ".json"
+
+    def build(self):
+        """
+        Extract, chunk and index every handbook.
+
+        Returns:
+            tuple: (arrays dict, metadata dict) in the on-disk format
+        """
+        store = get_text_store()
+        store.build(self.references)
+
+        vocab = {}
+        postings = {}  # term id -> {chunk id: tf}
+        chunk_source, chunk_page_number, chunk_start, chunk_end, doc_len = [], [], [], [], []
+        for source_id, reference in enumerate(self.references):
+            handbook = store.open(reference)
+            for page, text in handbook.pages():
+                page_start = handbook.manifest["pages"][page - 1]["start"]
+                data = text.encode("utf-8")
+                for start, end in chunk_page(text):
+                    chunk_id = len(doc_len)
+                    tokens = tokenize(data[start:end].decode("utf-8"))
+                    chunk_source.append(source_id)
+                    chunk_page_number.append(page)
+                    chunk_start.append(page_start + start)
+                    chunk_end.append(page_start + end)
+                    doc_len.append(len(tokens))
+                    for token in tokens:
+                        term = vocab.setdefault(token, len(vocab))
+                        counts = postings.setdefault(term, {})
+                        counts[chunk_id] = counts.get(chunk_id, 0) + 1
+
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        post_docs, post_tf = [], []
+        for term in range(len(vocab)):
+            counts = postings[term]
+            post_docs.extend(counts.keys())
+            post_tf.extend(counts.values())
+            term_ptr[term + 1] = len(post_docs)
+
+        arrays = {
+            "term_ptr": term_ptr,
+            "post_docs": np.asarray(post_docs, dtype=np.int32),
+            "post_tf": np.asarray(post_tf, dtype=np.float32),
+            "doc_len": np.asarray(doc_len, dtype=np.float32),
+            "chunk_source": np.asarray(chunk_source, dtype=np.int16),
+            "chunk_page": np.asarray(chunk_page_number, dtype=np.int32),
+            "chunk_start": np.asarray(chunk_start, dtype=np.int64),
+            "chunk_end": np.asarray(chunk_end, dtype=np.int64)
+        }
+        metadata = {"format": INDEX_FORMAT, "files": self.file_hashes(), "sources": self.references, "vocab": vocab}
+        return arrays, metadata
+
+    def _save(self, arrays, metadata):
+        os.makedirs(self.index_dir, exist_ok=True)
+        npz_path, json_path = self._paths()
+        # write under temporary names so a concurrent worker never loads half a file
+        tmp_npz, tmp_json = f"{npz_path}.{os.getpid()}.tmp.npz", f"{json_path}.{os.getpid()}.tmp"
+        np.savez(tmp_npz, **arrays)
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(tmp_json, json_path)
+        os.replace(tmp_npz, npz_path)
+
+    def _load_saved(self):
+        npz_path, json_path = self._paths()
+        if not (os.path.exists(npz_path) and os.path.exists(json_path)):
+            return None
+        try:
+            with open(json_path, encoding="utf-8") as f:
+                metadata = json.load(f)
+            with np.load(npz_path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable handbook index {npz_path}: {str(e)}")
+            return None
+        if metadata.get("format") != INDEX_FORMAT or metadata.get("files") != self.file_hashes():
+            return None
+        return arrays, metadata
+
+    def _install(self, arrays, metadata):
+        doc_len = arrays["doc_len"]
+        n_docs = len(doc_len)
+        df = np.diff(arrays["term_ptr"]).astype(np.float32)
+        avg_len = float(doc_len.mean()) if n_docs else 1.0
+        store = get_text_store()
+        texts = [store.open(reference) for reference in metadata["sources"]]
+        with self._lock:
+            self._term_ptr = arrays["term_ptr"]
+            self._post_docs = arrays["post_docs"]
+            self._post_tf = arrays["post_tf"]
+            self._idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+            # per-chunk length normalization, precomputed once
+            self._norm = (BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / max(avg_len, 1.0))).astype(np.float32)
+            self._vocab = metadata["vocab"]
+            self._sources = metadata["sources"]
+            self._texts = texts
+            self._doc_len = doc_len
+            self._chunk_source = arrays["chunk_source"]
+            self._chunk_page = arrays["chunk_page"]
+            self._chunk_start = arrays["chunk_start"]
+            self._chunk_end = arrays["chunk_end"]
+
+    def _ingest(self):
+        try:
+            self._set_status("loading")
+            start = time.perf_counter()
+            saved = self._load_saved()
+            if saved is None:
+                self._set_status("building")
+                saved = self.build()
+                self._save(*saved)
+            self._install(*saved)
+            with self._lock:
+                self._state.update(status="ready", ready_at=time.time(), chunks=len(self._doc_len),
+                                   terms=len(self._vocab), load_seconds=round(time.perf_counter() - start, 3))
+            self._ready.set()
+            logger.info(f"handbook index {self.session_id} is ready ({len(self._doc_len)} chunks)")
+        except Exception as e:
+            logger.error(f"Building handbook index {self.session_id} failed: {str(e)}")
+            with self._lock:
+                self._state["status"] = "failed"
+                self._state["error"] = str(e)
+                self._failed_at = time.monotonic()
+
+    def _set_status(self, status):
+        with self._lock:
+            self._state["status"] = status
+
+    def start_ingestion(self):
+        """
+        Load (or build) the index on a background thread; returns immediately.
+        """
+        with self._lock:
+            if self._ready.is_set():
+                return
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER:
+                return
+            self._failed_at = None
+            self._state = {"status": "starting", "started_at": time.time()}
+            self._thread = threading.Thread(target=self._ingest, name="handbook-index", daemon=True)
+            self._thread.start()
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def nearly_ready(self):
+        """
+        Tell whether a short wait is likely to end with the index ready: it is
+        being loaded or built in-process, which takes seconds at most. A failed
+        build is not retried for RETRY_AFTER, so there is nothing to wait for.
+        """
+        with self._lock:
+            return self._state["status"] in ("starting", "loading", "building")
+
+    def get_state(self):
+        with self._lock:
+            state = dict(self._state)
+        state["session_id"] = self.session_id
+        state["mode"] = "local"
+        return state
+
+    def chunk(self, chunk_id):
+        """
+        Return one chunk's handbook, page and text (sliced from the text store).
+        """
+        source_id = int(self._chunk_source[chunk_id])
+        return {
+            "source": self._sources[source_id],
+            "page": int(self._chunk_page[chunk_id]),
+            "text": self._texts[source_id].slice(int(self._chunk_start[chunk_id]), int(self._chunk_end[chunk_id]))
+        }
+
+    @timed("handbook.search")
+    def search(self, query, rag_k=5):
+        """
+        Score every chunk against the query with BM25.
+
+        Returns:
+            list: (score, chunk) pairs, best first, at most rag_k of them
+        """
+        term_ids = {self._vocab[token] for token in tokenize(query) if token in self._vocab}
+        if not term_ids or rag_k <= 0:
+            return []
+
+        scores = np.zeros(len(self._doc_len), dtype=np.float32)
+        for term in term_ids:
+            start, end = self._term_ptr[term], self._term_ptr[term + 1]
+            docs = self._post_docs[start:end]
+            tf = self._post_tf[start:end]
+            scores[docs] += self._idf[term] * tf * (BM25_K1 + 1.0) / (tf + self._norm[docs])
+
+        k = min(rag_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunk(i)) for i in top if scores[i] > 0]
+
+    def retrieve(self, query, rag_threshold=0.5, rag_k=5):
+        """
+        Retrieve handbook chunks in the same shape LLMProxy's retrieve returns.
+
+        BM25 scores are unbounded, so rag_threshold is applied relative to
+        the best hit: a chunk is kept if it scores at least rag_threshold
+        times the top score. Each chunk is prefixed with its page for citation.
+
+        Returns:
+            list: [{"doc_id", "doc_summary", "chunks"}], one entry per handbook,
+            best-matching handbook first
+        """
+        if not self._ready.is_set():
+            return []
+        hits = self.search(query, rag_k)
+        if not hits:
+            return []
+
+        cutoff = hits[0][0] * rag_threshold
+        collections = {}
+        for score, chunk in hits:
+            if score < cutoff:
+                break
+            source = chunk["source"]
+            if source not in collections:
+                collections[source] = {
+                    "doc_id": source,
+                    "doc_summary": f"{HANDBOOK_TITLES.get(source, source)} ({source})",
+                    "chunks": []
+                }
+            collections[source]["chunks"].append(f"[{source}, p. {chunk['page']}] {chunk['text']}")
+        return list(collections.values())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_handbook_index():
+    """
+    Return the process-wide local handbook index.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = HandbookIndex()
+    return _index
+
+
+def get_corpus():
+    """
+    Return the handbook backend selected by RAG_MODE: the local index or the
+    shared LLMProxy session.
+    """
+    if RAG_MODE == "local":
+        return get_handbook_index()
+    return get_corpus_manager()
+
+
+if __name__ == "__main__":
+    # python -m utils.handbook_index: build (or verify) the on-disk index ahead of deployment
+    index = get_handbook_index()
+    index._ingest()
+    print(json.dumps(index.get_state(), indent=2))
@@ -0,0 +1,160 @@
+# utils/history.py
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReturnDocument
+
+from llmproxy import generate
+from prompt import CONVERSATION_SUMMARY_PROMPT
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WINDOW = int(os.environ.get("HISTORY_WINDOW", "6"))  # Most recent turns replayed verbatim (caps lastk)
+SUMMARY_BATCH = int(os.environ.get("HISTORY_SUMMARY_BATCH", "4"))  # Older turns folded into the summary at a time
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+MAX_TURN_CHARS = 1500  # Per question/answer kept for summarizing
+# turns kept in the profile; if summarizing keeps failing the oldest are dropped unsummarized
+MAX_BUFFERED_TURNS = HISTORY_WINDOW + 4 * SUMMARY_BATCH
+
+
+def replay_window(user_profile):
+    """
+    Return the lastk to replay for a student.
+
+    Every turn the rolling summary does not cover yet is replayed, which is
+    at least the last HISTORY_WINDOW turns and never more than
+    HISTORY_WINDOW + SUMMARY_BATCH, however long the conversation is.
+    """
+    unsummarized = int(user_profile.get("last_k") or 0) - int(user_profile.get("summary_through") or 0)
+    return max(0, min(unsummarized, HISTORY_WINDOW + SUMMARY_BATCH))
+
+
+def _clip(text):
+    text = str(text or "")
+    return text if len(text) <= MAX_TURN_CHARS else text[:MAX_TURN_CHARS] + "..."
+
+
+class HistoryManager:
+    """
+    Keeps per-message prompt cost flat however long a conversation runs.
+
+    The LLM only replays the turns the summary does not cover (see
+    replay_window); older ones reach the system prompt through
+    history_summary.
+    Every answered turn is also appended to recent_turns in the profile, and
+    once SUMMARY_BATCH turns have fallen out of the window they are folded
+    into history_summary by one small generate call. All of that runs on a
+    private thread pool after the reply has been sent, so it never adds
+    latency to /query. summary_through records the last turn the summary
+    covers, so a concurrent or retried refresh cannot fold a turn twice.
+    """
+
+    def __init__(self, window=HISTORY_WINDOW, batch=SUMMARY_BATCH, max_workers=2):
+        self.window = window
+        self.batch = batch
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="history")
+        self._lock = threading.Lock()
+        self._summarizing = set()  # user_ids with a refresh in flight
+        self._stats = {"recorded": 0, "summaries": 0, "failures": 0}
+
+    def record_turn(self, user_id, turn, question, answer):
+        """
+        Queue one answered turn for the student's history; returns immediately.
+        """
+        if not HISTORY_SUMMARY_ENABLED:
+            return None
+        return self._pool.submit(self._record, user_id, turn, question, answer)
+
+    def _record(self, user_id, turn, question, answer):
+        try:
+            collection = get_collection("Users", "user")
+            if collection is None:
+                return
+            profile = collection.find_one_and_update(
+                {"user_id": user_id},
+                {"$push": {"recent_turns": {
+                    "$each": [{"n": turn, "q": _clip(question), "a": _clip(answer)}],
+                    "$slice": -MAX_BUFFERED_TURNS
+                }}},
+                projection={"recent_turns": 1, "history_summary": 1, "summary_through": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            with self._lock:
+                self._stats["recorded"] += 1
+            if profile is not None:
+                self._maybe_summarize(collection, user_id, profile)
+        except Exception as e:
+            with self._lock:
+                self._stats["failures"] += 1
+            logger.error(f"Updating conversation history for {user_id} failed: {str(e)}")
+
+    def _maybe_summarize(self, collection, user_id, profile):
+        through = profile.get("summary_through")
+        turns = sorted(
+            (t for t in profile.get("recent_turns") or [] if through is None or t["n"] > through),
+            key=lambda t: t["n"]
+        )
+        older = turns[:-self.window] if self.window else turns
+        if len(older) < self.batch:
+            return
+
+        with self._lock:
+            if user_id in self._summarizing:
+                return
+            self._summarizing.add(user_id)
+        try:
+            summary = self.summarize(user_id, profile.get("history_summary"), older)
+            if not summary:
+                raise RuntimeError("empty summary")
+            # only apply on top of the summary this one was built from
+            result = collection.update_one(
+                {"user_id": user_id, "summary_through": through},
+                {
+                    "$set": {"history_summary": summary, "summary_through": older[-1]["n"]},
+                    "$pull": {"recent_turns": {"n": {"$lte": older[-1]["n"]}}}
+                }
+            )
+            with self._lock:
+                self._stats["summaries" if result.modified_count else "failures"] += 1
+        finally:
+            with self._lock:
+                self._summarizing.discard(user_id)
+
+    def summarize(self, user_id, previous_summary, turns):
+        """
+        Fold turns into the previous summary with one generate call.
+
+        Returns:
+            str: the new summary, or "" if the call failed
+        """
+        transcript = "\n".join(f"Student: {t['q']}\nAdvisor: {t['a']}" for t in turns)
+        query = f"Previous summary:\n{previous_summary or 'none'}\n\nNew conversation turns:\n{transcript}"
+        response = generate(
+            model='4o-mini',
+            system=CONVERSATION_SUMMARY_PROMPT,
+            query=query,
+            temperature=0.0,
+            lastk=0,
+            session_id='cs-advising-history-summary-' + user_id,
+            rag_usage=False
+        )
+        if not isinstance(response, dict):
+            logger.warning("Conversation summary failed: %s", response)
+            return ""
+        return (response.get('response') or "").strip()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["summarizing"] = len(self._summarizing)
+        stats.update(window=self.window, batch=self.batch, enabled=HISTORY_SUMMARY_ENABLED)
+        return stats
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+history_manager = HistoryManager()
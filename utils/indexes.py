@@ -0,0 +1,134 @@
+# utils/indexes.py
+import argparse
+import logging
+import sys
+
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import PyMongoError
+
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+# (database, collection, keys, options) for every index the app relies on
+INDEXES = [
+    # profile lookups and the atomic upsert in /query; unique so concurrent
+    # first messages from one student cannot create two profiles
+    ("Users", "user", [("user_id", ASCENDING)], {"unique": True, "name": "user_id_unique"}),
+    # direct-forwarding lookups for messages posted inside an escalation thread
+    ("Users", "threads", [("thread_id", ASCENDING)], {"unique": True, "name": "thread_id_unique"}),
+    # /faqs listing order and question_id lookups
+    ("freq_questions", "questions", [("question_id", ASCENDING)], {"unique": True, "name": "question_id_unique"}),
+    # /faqs search box
+    ("freq_questions", "questions", [("question", TEXT), ("answer", TEXT)],
+     {"name": "faq_text", "weights": {"question": 3, "answer": 1}}),
+]
+
+# Every query shape the app runs in production, as
+# (description, database, collection, filter, sort, full_scan_expected).
+# full_scan_expected marks reads that intentionally touch every document.
+QUERY_SHAPES = [
+    ("profile by user_id (/query, /student-info)", "Users", "user", {"user_id": "shape-check"}, None, False),
+    ("thread mapping by thread_id (/query)", "Users", "threads", {"thread_id": "shape-check"}, None, False),
+    ("FAQ list sorted by question_id (/faqs)", "freq_questions", "questions", {}, [("question_id", ASCENDING)], False),
+    ("FAQ page after a cursor (/faqs)", "freq_questions", "questions", {"question_id": {"$gt": 0}}, [("question_id", ASCENDING)], False),
+    ("FAQ text search (/faqs?q=)", "freq_questions", "questions", {"$text": {"$search": "shape-check"}}, [("question_id", ASCENDING)], False),
+    ("FAQ by question_id", "freq_questions", "questions", {"question_id": 0}, None, False),
+    ("FAQ matcher index load", "freq_questions", "questions", {"question": {"$exists": True}}, None, True),
+]
+
+
+def ensure_indexes():
+    """
+    Create the indexes in INDEXES if they do not exist yet.
+
+    create_index is a no-op for an identical existing index, so this is safe to
+    run on every startup. Failures (e.g. duplicates blocking a unique index)
+    are logged instead of stopping the app.
+
+    Returns:
+        bool: True if every index is in place
+    """
+    ok = True
+    for database_name, collection_name, keys, options in INDEXES:
+        collection = get_collection(database_name, collection_name)
+        if collection is None:
+            return False
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as e:
+            logger.error(f"Could not create index {options.get('name')} on {database_name}.{collection_name}: {e}")
+            ok = False
+    return ok
+
+
+def _plan_stages(plan):
+    """
+    Yield every stage name in an explain() plan tree.
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def check_query_plans():
+    """
+    Run explain() on each production query shape and report the winning plan.
+
+    Returns:
+        list: one dict per shape with the plan stages and whether it is a COLLSCAN
+        that was not expected
+    """
+    results = []
+    for description, database_name, collection_name, query, sort, full_scan_expected in QUERY_SHAPES:
+        collection = get_collection(database_name, collection_name)
+        if collection is None:
+            raise RuntimeError("MongoDB is not connected")
+
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_plan_stages(winning_plan))
+        results.append({
+            "shape": description,
+            "namespace": f"{database_name}.{collection_name}",
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages and not full_scan_expected
+        })
+    return results
+
+
+def main(argv=None):
+    """
+    Diagnostic command: python -m utils.indexes [--ensure]
+
+    Exits with status 1 if any production query shape would run as a COLLSCAN.
+    """
+    parser = argparse.ArgumentParser(description="Check that production MongoDB queries are index-backed.")
+    parser.add_argument("--ensure", action="store_true", help="create missing indexes before checking")
+    args = parser.parse_args(argv)
+
+    if args.ensure and not ensure_indexes():
+        print("❌ Some indexes could not be created, see the log above")
+
+    failed = False
+    for result in check_query_plans():
+        if result["collscan"]:
+            failed = True
+            print(f"❌ COLLSCAN  {result['namespace']:32} {result['shape']}  ({' > '.join(result['stages'])})")
+        else:
+            print(f"✅ {result['namespace']:41} {result['shape']}  ({' > '.join(result['stages'])})")
+
+    if failed:
+        print("Some query shapes are not index-backed. Run `python -m utils.indexes --ensure`.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# utils/intent_router.py
+import os
+import re
+import threading
+
+from utils.response_cache import normalize_question
+
+INTENT_ROUTER_ENABLED = os.environ.get("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+MAX_ROUTED_WORDS = 12  # Longer messages carry a real question and always go to the LLM
+
+# literal texts our own buttons send (see format_response_with_buttons)
+BUTTON_PAYLOADS = {
+    normalize_question("Talk to a human advisor"): "handoff"
+}
+
+# The whole normalized message has to match, so "hi, can I transfer credits?"
+# still goes to the LLM.
+INTENT_RULES = [
+    ("handoff", "4", re.compile(
+        r"(please |can i |could i |i want to |i d like to |i would like to |i need to |let me |)"
+        r"(talk|speak|chat|connect|get in touch)( me)? (to|with) (a |an |the |my |)"
+        r"(human|real person|person|real human|human advisor|advisor|adviser|staff member)( advisor| please| now)*"
+        r"|(human|real person|human advisor|human support)( please)?"
+    )),
+    ("greeting", "1", re.compile(
+        r"((hi|hello|hey|hiya|howdy|greetings|good (morning|afternoon|evening))"
+        r"( there| bot| advisor| everyone| all)*( how are you( doing)?)?|how are you( doing)?)"
+    )),
+    ("farewell", "7", re.compile(
+        r"((ok |okay |great |perfect |got it |cool |)(thanks|thank you|thx|ty)( so much| a lot| very much| again)*"
+        r"( bye| goodbye)?|bye|goodbye|see you|see ya|that s all|that is all)"
+    ))
+]
+
+
+class IntentRouter:
+    """
+    Recognizes messages whose reply does not need the LLM: our own button
+    payloads, requests for a human advisor, greetings and thank-yous.
+
+    Matching is a set lookup plus a few anchored regexes on the normalized
+    text, and every match maps to the category the system prompt would have
+    assigned. Counters give the share of messages answered locally.
+    """
+
+    def __init__(self, enabled=INTENT_ROUTER_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._hits = {}
+
+    def route(self, message):
+        """
+        Classify a message locally.
+
+        Returns:
+            dict: {"intent", "category_id", "source": "button" or "rule"}, or
+            None if the message has to go through the LLM
+        """
+        if not self.enabled:
+            return None
+        normalized = normalize_question(message or "")
+        route = None
+        if normalized in BUTTON_PAYLOADS:
+            route = {"intent": BUTTON_PAYLOADS[normalized], "category_id": "4", "source": "button"}
+        elif normalized and len(normalized.split()) <= MAX_ROUTED_WORDS:
+            for intent, category_id, pattern in INTENT_RULES:
+                if pattern.fullmatch(normalized):
+                    route = {"intent": intent, "category_id": category_id, "source": "rule"}
+                    break
+
+        with self._lock:
+            self._checked += 1
+            if route is not None:
+                key = f"{route['intent']}.{route['source']}"
+                self._hits[key] = self._hits.get(key, 0) + 1
+        return route
+
+    def get_stats(self):
+        with self._lock:
+            hits = sum(self._hits.values())
+            return {
+                "enabled": self.enabled,
+                "checked": self._checked,
+                "routed": hits,
+                "hit_rate": round(hits / self._checked, 4) if self._checked else 0.0,
+                "intents": dict(self._hits)
+            }
+
+
+intent_router = IntentRouter()
@@ -0,0 +1,326 @@
+# utils/llm_json.py
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_FENCE = re.compile(r"```(?:json|JSON)?")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def decode_partial_string(raw):
+    """
+    Decode the body of a JSON string literal that may be cut off mid-stream.
+
+    Escapes that are complete are decoded, a dangling backslash or partial
+    \\uXXXX at the end is dropped, and raw newlines are kept as they are.
+    """
+    chars = []
+    i = 0
+    while i < len(raw):
+        ch = raw[i]
+        if ch != "\\":
+            chars.append(ch)
+            i += 1
+            continue
+        if i + 1 >= len(raw):
+            break
+        escape = raw[i + 1]
+        if escape == "u":
+            if i + 6 > len(raw):
+                break
+            try:
+                chars.append(chr(int(raw[i + 2:i + 6], 16)))
+            except ValueError:
+                pass
+            i += 6
+            continue
+        chars.append(_SIMPLE_ESCAPES.get(escape, escape))
+        i += 2
+    return "".join(chars)
+
+
+def _escape_control_chars(text):
+    """
+    Escape raw newlines/tabs that the model left inside string literals.
+    """
+    out = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            elif ch == "\r":
+                ch = "\\r"
+            elif ch == "\t":
+                ch = "\\t"
+        elif ch == '"':
+            in_string = True
+        out.append(ch)
+    return "".join(out)
+
+
+def _close_truncated(text):
+    """
+    Close an unterminated string and any open objects/arrays at the end of a truncated reply.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        text = (text[:-1] if escape else text) + '"'
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _first_object(text):
+    """
+    Return the first balanced {...} object in text, or everything from the first
+    brace if the object never closes.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def repair_json(text):
+    """
+    Parse a JSON value from LLM output, repairing common malformations locally.
+
+    Handles markdown code fences, chatter before or after the object, trailing
+    commas, raw newlines inside strings and replies truncated mid-object.
+
+    Raises:
+        ValueError: if no JSON value can be recovered
+    """
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    candidate = _FENCE.sub("", text or "").strip()
+    if "{" in candidate:
+        candidate = _first_object(candidate)
+    if not candidate:
+        raise ValueError("no JSON object found in LLM reply")
+
+    candidate = _escape_control_chars(candidate)
+    candidate = _TRAILING_COMMA.sub(r"\1", candidate)
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", _close_truncated(candidate))):
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("unable to repair JSON in LLM reply")
+
+
+class IncrementalReplyParser:
+    """
+    Pulls top-level fields out of an LLM JSON reply while it is still streaming.
+
+    Feed chunks as they arrive. Each top-level field (category_id, response,
+    suggestedQuestions, rocketChatPayload, ...) is reported through `on_field`
+    the moment its value is complete, so routing can start as soon as
+    "category_id" arrives. Anything before the first "{" (chatter, code
+    fences) is ignored, and partial_text() exposes a string field that is
+    still being generated.
+
+    Chunks are buffered in a list and only joined when a field is sliced out
+    or the text is read, so feeding a long stream stays linear.
+    """
+
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.fields = {}
+        self._chunks = []
+        self._size = 0  # characters fed so far
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._value_start = None
+        self._done = False
+
+    @property
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk):
+        """
+        Add a chunk of the reply and scan it for completed fields.
+        """
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        if not self._done:
+            self._scan(chunk, self._size)
+        self._size += len(chunk)
+
+    def consume(self, chunks):
+        """
+        Feed every chunk of a stream, yielding each one onward.
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+    def _emit(self, key, raw):
+        try:
+            value = repair_json(raw.strip())
+        except ValueError:
+            logger.warning(f"could not parse streamed field {key}")
+            return
+        self.fields[key] = value
+        if self.on_field:
+            try:
+                self.on_field(key, value)
+            except Exception:
+                logger.exception(f"on_field callback failed for {key}")
+
+    def _scan(self, chunk, offset):
+        # i is the absolute position in the reply, so slices use self.text
+        for i, ch in enumerate(chunk, offset):
+            if self._done:
+                break
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        text = self.text
+                        if self._key is None or self._value_start is None:
+                            self._last_string = text[self._string_start:i]
+                        elif not text[self._value_start:self._string_start - 1].strip():
+                            # a top-level string value is complete: emit it right away
+                            self._emit(self._key, text[self._value_start:i + 1])
+                            self._key = None
+                            self._value_start = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._key is not None and self._value_start is not None:
+                        self._emit(self._key, self.text[self._value_start:i])
+                    self._key = None
+                    self._value_start = None
+                    self._done = True
+            elif self._depth == 1 and ch == ":":
+                self._key = self._last_string
+                self._value_start = i + 1
+            elif self._depth == 1 and ch == ",":
+                if self._key is not None and self._value_start is not None:
+                    self._emit(self._key, self.text[self._value_start:i])
+                self._key = None
+                self._value_start = None
+
+    def partial_text(self, key="response"):
+        """
+        Return the value of a top-level string field, even while it is being streamed.
+        """
+        value = self.fields.get(key)
+        if isinstance(value, str):
+            return value
+        if self._key == key and self._in_string and self._value_start is not None \
+                and self._string_start is not None and self._string_start > self._value_start:
+            return decode_partial_string(self.text[self._string_start:])
+        return ""
+
+    def result(self):
+        """
+        Return the parsed reply: the whole object if it can be repaired, otherwise
+        the fields recovered so far.
+
+        Raises:
+            ValueError: if not even a single field could be recovered
+        """
+        try:
+            parsed = repair_json(self.text)
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+        if self.fields:
+            return dict(self.fields)
+        raise ValueError("no fields recovered from LLM reply")
+
+
+def parse_llm_reply(text):
+    """
+    Parse a complete LLM reply into a dict, tolerating fences, chatter and small
+    syntax errors.
+
+    Raises:
+        ValueError: if the reply contains no recoverable JSON object
+    """
+    parser = IncrementalReplyParser()
+    parser.feed(text or "")
+    return parser.result()
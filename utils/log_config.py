@@ -1,34 +1,175 @@
+import atexit
+import json
 import logging
-import logging.config
+import logging.handlers
+import os
+import queue
+import random
+import threading
 
-# Or from a dictionary
-def setup_logging():
-    config_dict = {
-        'version': 1,
-        'formatters': {
-            'standard': {
-                'format': '%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'
-            },
-        },
-        'handlers': {
-            'console': {
-                'class': 'logging.StreamHandler',
-                'level': 'INFO',
-                'formatter': 'standard'
-            },
-            'file': {
-                'class': 'logging.FileHandler',
-                'filename': 'app.log',
-                'level': 'DEBUG',
-                'formatter': 'standard'
-            }
-        },
-        'loggers': {
-            '': {  # Root logger
-                'handlers': ['console', 'file'],
-                'level': 'DEBUG',
-                'propagate': True
-            }
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()  # DEBUG enables the verbose request/LLM dumps
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # Rotate app.log at this size
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # Records held for the writer thread before dropping
+LOG_CONSOLE_FORMAT = os.environ.get("LOG_CONSOLE_FORMAT", "text")  # "text" or "json"
+
+# "logger=rate,..." - fraction of DEBUG records kept per logger (and its children)
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "advisor=0.1,llmproxy=0.1")
+
+# chatty third-party loggers
+QUIET_LOGGERS = {"urllib3": "WARNING", "pymongo": "WARNING", "werkzeug": "INFO", "pypdf": "ERROR"}
+
+# attributes every LogRecord has; anything else came in through extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, source location, message,
+    any extra={...} fields and the formatted exception.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "file": f"{record.filename}:{record.lineno}",
+            "thread": record.threadName,
+            "msg": record.getMessage()
         }
-    }
-    logging.config.dictConfig(config_dict)
\ No newline at end of file
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records from noisy loggers.
+
+    Rates apply to a logger and its children ("advisor" covers
+    "advisor.x"); INFO and above always pass.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    @staticmethod
+    def parse(spec):
+        rates = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, rate = item.partition("=")
+            rates[name.strip()] = float(rate)
+        return rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the writer thread falls
+    behind and the queue is full, the record is dropped and counted.
+
+    Records are handed over unformatted, so %-style arguments are only merged
+    into the message on the writer thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # the traceback must be rendered while it still describes this thread's stack
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """
+    Route all logging through an in-memory queue drained by a background thread.
+
+    Request threads only put records on the queue; the QueueListener thread
+    formats them and does the console and (size-rotated, JSON-lines) file
+    writes. Safe to call more than once.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        text_formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s')
+        json_formatter = JsonFormatter()
+
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        console.setFormatter(json_formatter if LOG_CONSOLE_FORMAT == "json" else text_formatter)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+        file_handler.setFormatter(json_formatter)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(SamplingFilter.parse(LOG_SAMPLE_RATES)))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        # disabled levels are rejected by isEnabledFor before any formatting happens
+        root.setLevel(LOG_LEVEL)
+        for name, level in QUIET_LOGGERS.items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the writer thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logging_stats():
+    """
+    Report queue depth and dropped records for monitoring.
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            return {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+    return {}
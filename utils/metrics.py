@@ -0,0 +1,200 @@
+# utils/metrics.py
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+# seconds; covers a cached answer (~ms) up to a slow LLM call or handbook upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# labels attached to the query currently being handled on this thread
+_query_labels = contextvars.ContextVar("query_labels", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    Latency histogram with a fixed label set, rendered in Prometheus text format.
+
+    Each label combination keeps cumulative-on-render bucket counts, a sum and
+    a count. An observation is one bisect plus a few integer adds under a lock.
+    """
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key in sorted(snapshot):
+            series = snapshot[key]
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return "\n".join(lines)
+
+
+# Metrics are per process; with several gunicorn workers each one is scraped
+# (or summed) separately.
+HTTP_REQUEST_SECONDS = Histogram(
+    "advisor_http_request_duration_seconds",
+    "Time to answer an HTTP request, by route, method, status and category_id.",
+    ("route", "method", "status", "category_id")
+)
+QUERY_SECONDS = Histogram(
+    "advisor_query_duration_seconds",
+    "Time to handle one /query message (sync or queued), by category_id and the path that answered it.",
+    ("category_id", "path")
+)
+STAGE_SECONDS = Histogram(
+    "advisor_stage_duration_seconds",
+    "Time spent in one stage of handling a message (Mongo, LLMProxy, RocketChat, ...).",
+    ("stage",)
+)
+
+REGISTRY = [HTTP_REQUEST_SECONDS, QUERY_SECONDS, STAGE_SECONDS]
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a block as one stage: `with stage_timer("mongo.profile"): ...`
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed(stage):
+    """
+    Decorator form of stage_timer.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def timed_query(fn):
+    """
+    Decorator for the /query handler: times each call and labels it with the
+    category_id recorded through set_query_labels() while it ran.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not METRICS_ENABLED:
+            return fn(*args, **kwargs)
+        labels = {"category_id": "none", "path": "none"}
+        token = _query_labels.set(labels)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - start, **labels)
+            _query_labels.reset(token)
+            # let the HTTP-level histogram pick up the same category
+            outer = _request_labels()
+            if outer is not None:
+                outer["category_id"] = labels["category_id"]
+    return wrapper
+
+
+def set_query_labels(**values):
+    """
+    Label the query being handled on this thread, e.g. set_query_labels(category_id="2", path="llm").
+    """
+    labels = _query_labels.get()
+    if labels is not None:
+        labels.update((name, str(value)) for name, value in values.items())
+
+
+def _request_labels():
+    if not has_request_context():
+        return None
+    return g.setdefault("metrics_labels", {})
+
+
+def init_app(app):
+    """
+    Register request timing hooks on a Flask app.
+    """
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            labels = g.get("metrics_labels") or {}
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                route=request.url_rule.rule if request.url_rule else "unmatched",
+                method=request.method,
+                status=response.status_code,
+                category_id=labels.get("category_id", "")
+            )
+        return response
+
+
+def render_metrics():
+    """
+    Return every metric in Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
@@ -0,0 +1,211 @@
+# utils/rag_profiles.py
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from utils.faq_matcher import N_FEATURES, tf_vector
+from utils.faq_version import read_faq_version
+from utils.mongo_config import get_collection
+from utils.response_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+RAG_PROFILES_ENABLED = os.environ.get("RAG_PROFILES_ENABLED", "true").lower() == "true"
+MIN_SIMILARITY = float(os.environ.get("RAG_PROFILE_MIN_SIMILARITY", "0.3"))  # Below this the default profile is used
+VERSION_CHECK_INTERVAL = 30  # Seconds between checks for FAQ edits made by other workers
+
+# retrieval settings per profile; "default" is what every question used before
+RAG_PROFILES = {
+    "precision": {"rag_threshold": 0.8, "rag_k": 3},
+    "balanced": {"rag_threshold": 0.7, "rag_k": 5},
+    "broad": {"rag_threshold": 0.6, "rag_k": 7},
+    "default": {"rag_threshold": 0.5, "rag_k": 5}
+}
+
+# Keyword rules, checked in this order (narrowest profile first). They follow
+# the tiers the LLM-based parameter inference in llmproxy.py was prompted with.
+PROFILE_RULES = [
+    ("precision", re.compile(
+        r"\b(dismiss\w*|academic standing|probation\w*|thesis|theses|dissertation\w*|defen[cs]e\w*|committee|"
+        r"leave of absence|(personal|medical|parental) leave|time off|continuous enrollment|"
+        r"registration deadline\w*|add drop|fifth year|5th year|bs ms|ba ms|double count\w*)\b"
+    )),
+    ("balanced", re.compile(
+        r"\b(transfer\w*|extension\w*|time limit|co ?op\w*|academic integrity|plagiari\w*|cheating|"
+        r"english (language )?proficiency|toefl|ielts|degree only|enrollment status|part time|full time)\b"
+    )),
+    ("broad", re.compile(
+        r"\b(health service\w*|counsel\w*|therap\w*|mental health|staar|graduate student council|gsc|"
+        r"professional development|career\w*|shuttle\w*|bus|buses|transportation|parking|facilit\w*|librar\w*|"
+        r"gym|housing|dining|campus resource\w*)\b"
+    ))
+]
+
+# example questions per profile, so the model has a centroid even before any FAQ is labelled
+SEED_QUESTIONS = {
+    "precision": [
+        "What happens if I am dismissed for poor academic standing?",
+        "How do I schedule my thesis defense?",
+        "What is the policy for a medical or parental leave?",
+        "When is the registration deadline and do I need continuous enrollment?",
+        "Which courses can be double counted in the fifth-year master's program?"
+    ],
+    "balanced": [
+        "Can I transfer credits from another university?",
+        "How do I request an extension of my degree time limit?",
+        "Am I eligible for the co-op program?",
+        "What is the academic integrity policy?",
+        "What are the English language proficiency requirements?",
+        "What does degree-only status mean for my enrollment?"
+    ],
+    "broad": [
+        "Where are the health and counseling services on campus?",
+        "What does the StAAR Center offer graduate students?",
+        "How do I get involved with the Graduate Student Council?",
+        "Are there professional development opportunities?",
+        "When does the campus shuttle run?",
+        "Which libraries and facilities can graduate students use?"
+    ]
+}
+
+LABELS = ["precision", "balanced", "broad"]
+
+
+def rule_profile(text):
+    """
+    Return the first profile whose keywords appear in the text, or None.
+    """
+    normalized = normalize_question(text)
+    for profile, pattern in PROFILE_RULES:
+        if pattern.search(normalized):
+            return profile
+    return None
+
+
+class RAGProfileClassifier:
+    """
+    Maps a question to a retrieval profile (rag_threshold and rag_k) locally.
+
+    Keyword rules decide when they match. Otherwise the question is compared
+    with one hashed TF-IDF centroid per profile, trained from the seed
+    questions plus every FAQ the rules can label, and the closest profile
+    wins if it is similar enough. Classifying is a regex scan and three dot
+    products, instead of the extra generate call the LLM-based inference
+    needed.
+    """
+
+    def __init__(self, min_similarity=MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # one version check/retrain at a time
+        self._centroids = None
+        self._idf = None
+        self._version = None
+        self._checked_at = 0.0
+        self._trained_on = 0
+        self._counts = {}
+
+    def train(self):
+        """
+        (Re)build the profile centroids from the seed questions and the FAQ collection.
+        """
+        examples = [(profile, question) for profile, questions in SEED_QUESTIONS.items() for question in questions]
+        version = read_faq_version()
+        collection = get_collection("freq_questions", "questions")
+        if collection is not None:
+            for doc in collection.find({"question": {"$exists": True}}, {"question": 1, "answer": 1}):
+                profile = rule_profile(f"{doc.get('question', '')} {doc.get('answer', '')}")
+                if profile is not None:
+                    examples.append((profile, doc["question"]))
+
+        vectors = np.stack([tf_vector(text) for _, text in examples])
+        df = (vectors > 0).sum(axis=0)
+        idf = (np.log((1.0 + len(examples)) / (1.0 + df)) + 1.0).astype(np.float32)
+        weighted = vectors * idf
+        weighted /= np.maximum(np.linalg.norm(weighted, axis=1, keepdims=True), 1e-9)
+
+        labels = np.array([LABELS.index(profile) for profile, _ in examples])
+        centroids = np.zeros((len(LABELS), N_FEATURES), dtype=np.float32)
+        for i in range(len(LABELS)):
+            centroids[i] = weighted[labels == i].sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-9)
+
+        with self._lock:
+            self._centroids = centroids
+            self._idf = idf
+            self._version = version
+            self._checked_at = time.monotonic()
+            self._trained_on = len(examples)
+        logger.info(f"RAG profile classifier trained on {len(examples)} examples")
+
+    def _ensure_current(self):
+        if self._centroids is not None and time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        with self._refresh_lock:
+            # re-check: a concurrent request may have trained or checked meanwhile
+            if self._centroids is None:
+                self.train()
+                return
+            now = time.monotonic()
+            if now - self._checked_at < VERSION_CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            version = read_faq_version()
+            if version is not None and version != self._version:
+                self.train()
+
+    def classify(self, query):
+        """
+        Pick a retrieval profile for a question.
+
+        Returns:
+            tuple: (profile name, how it was chosen: "rule", "model" or "default")
+        """
+        profile = rule_profile(query)
+        if profile is not None:
+            return profile, "rule"
+
+        self._ensure_current()
+        with self._lock:
+            centroids, idf = self._centroids, self._idf
+        query_vector = tf_vector(query) * idf
+        norm = float(np.linalg.norm(query_vector))
+        if norm == 0.0:
+            return "default", "default"
+        scores = centroids @ (query_vector / norm)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.min_similarity:
+            return LABELS[best], "model"
+        return "default", "default"
+
+    def params(self, query):
+        """
+        Return the rag_threshold and rag_k to retrieve handbook context for a question.
+
+        Returns:
+            dict: {"rag_threshold": float, "rag_k": int}
+        """
+        if not RAG_PROFILES_ENABLED:
+            return dict(RAG_PROFILES["default"])
+        profile, source = self.classify(query)
+        key = f"{profile}.{source}"
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+        logger.debug("RAG profile %s (%s) for %r", profile, source, query)
+        return dict(RAG_PROFILES[profile])
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "enabled": RAG_PROFILES_ENABLED,
+                "examples": self._trained_on,
+                "version": self._version,
+                "profiles": dict(self._counts)
+            }
+
+
+rag_profile_classifier = RAGProfileClassifier()
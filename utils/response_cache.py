@@ -0,0 +1,181 @@
+# utils/response_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from utils.cache import LRUCache
+from utils.faq_version import read_faq_version, bump_faq_version
+from utils.history import replay_window
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "3600"))  # Seconds a cached answer stays valid
+CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2048"))
+VERSION_CHECK_INTERVAL = 30  # Seconds between checks of the shared FAQ version counter
+
+# only handbook answers are cached: greetings embed the student's own link and
+# escalation categories must always reach the LLM and the human advisor
+CACHEABLE_CATEGORIES = {"2"}
+
+# Messages that lean on the previous turn ("tell me more", "does that apply to
+# PhD students?"); a false positive only costs a cache miss
+FOLLOW_UP_MAX_WORDS = 4  # Shorter messages rarely stand on their own
+_FOLLOW_UP = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|more|else|same|above|previous|again|also|too|instead)\b"
+    r"|^(and|but|so|then|what about|how about|why)\b"
+)
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """
+    Fold case, punctuation and whitespace so trivially different phrasings share a key.
+
+    Example: "  What is the Transfer-Credit policy?? " -> "what is the transfer credit policy"
+    """
+    text = _PUNCTUATION.sub(" ", text.casefold())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def profile_fingerprint(user_profile):
+    """
+    Reduce a profile to the fields the system prompt personalizes on.
+    """
+    transcript = (user_profile or {}).get("transcript") or {}
+    courses = sorted(
+        str(course.get("course_id", "")).replace(" ", "").upper()
+        for course in transcript.get("completed_courses") or []
+    )
+    return {
+        "program": transcript.get("program", ""),
+        "domestic": str(transcript.get("domestic", "")).lower(),
+        "GPA": str(transcript.get("GPA", "")),
+        "credits_earned": str(transcript.get("credits_earned", "")),
+        "courses": courses
+    }
+
+
+def carries_history(user_profile):
+    """
+    Tell whether the LLM would see earlier turns (replayed or summarized) for this student.
+    """
+    return replay_window(user_profile) > 0 or bool(user_profile.get("history_summary"))
+
+
+def is_follow_up(question):
+    """
+    Tell whether a message is short or refers back to the conversation, so its
+    answer only makes sense in that conversation.
+    """
+    normalized = normalize_question(question)
+    return len(normalized.split()) <= FOLLOW_UP_MAX_WORDS or bool(_FOLLOW_UP.search(normalized))
+
+
+def depends_on_conversation(question, user_profile):
+    """
+    Tell whether the answer to this message is built on earlier turns and must
+    not be shared with another student.
+    """
+    return carries_history(user_profile) and is_follow_up(question)
+
+
+class ResponseCache:
+    """
+    Cache of LLM answers keyed on the normalized question plus the profile
+    fields that personalize the answer and the handbook corpus version.
+    Follow-ups that lean on earlier turns ("tell me more", "does that apply to
+    PhD students?") bypass the cache whenever the student has conversation
+    history, so they never get another student's reply; standalone questions
+    are still cached for every student.
+
+    Entries expire after CACHE_TTL. Edits to the FAQ collection bump a shared
+    version counter (freq_questions.meta) so every worker drops its entries,
+    and a new handbook corpus changes the key so stale answers are never hit.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._faq_version = None
+        self._checked_at = 0.0
+        self._skipped = 0
+
+    def _skip(self, question, user_profile):
+        if not depends_on_conversation(question, user_profile):
+            return False
+        with self._lock:
+            self._skipped += 1
+        return True
+
+    def _check_faq_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        version = read_faq_version()
+        if version is None:
+            return
+
+        with self._lock:
+            if self._faq_version is not None and version != self._faq_version:
+                logger.info(f"FAQ version changed to {version}, clearing response cache")
+                self._cache.clear()
+            self._faq_version = version
+
+    def make_key(self, question, user_profile, corpus_version):
+        payload = json.dumps({
+            "q": normalize_question(question),
+            "profile": profile_fingerprint(user_profile),
+            "corpus": corpus_version
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, question, user_profile, corpus_version):
+        """
+        Return the cached response dict for this question and profile, or None.
+        """
+        if self._skip(question, user_profile):
+            return None
+        self._check_faq_version()
+        return self._cache.get(self.make_key(question, user_profile, corpus_version))
+
+    def put(self, question, user_profile, corpus_version, response_data):
+        """
+        Store a parsed LLM response if its category is safe to replay.
+        """
+        if response_data.get("category_id") not in CACHEABLE_CATEGORIES \
+                or depends_on_conversation(question, user_profile):
+            return
+        self._cache.set(self.make_key(question, user_profile, corpus_version), {
+            "category_id": response_data.get("category_id"),
+            "response": response_data.get("response"),
+            "suggestedQuestions": response_data.get("suggestedQuestions")
+        })
+
+    def invalidate_all(self):
+        """
+        Drop every cached answer here and tell the other workers to do the same.
+
+        Returns:
+            int or None: the new FAQ version
+        """
+        self._cache.clear()
+        version = bump_faq_version()
+        with self._lock:
+            self._faq_version = version
+        return version
+
+    def get_stats(self):
+        stats = self._cache.get_stats()
+        with self._lock:
+            stats["follow_ups_skipped"] = self._skipped
+        return stats
+
+
+response_cache = ResponseCache()
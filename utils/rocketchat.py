@@ -0,0 +1,200 @@
+# utils/rocketchat.py
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.metrics import stage_timer
+
+# Load environment variables from .env file
+load_dotenv()
+
+RC_BASE_URL = os.environ.get("RC_BASE_URL", "https://chat.genaiconnect.net/api/v1")
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "X-Auth-Token": os.environ.get("RC_token"),
+    "X-User-Id": os.environ.get("RC_userId")
+}
+
+POOL_SIZE = int(os.environ.get("RC_POOL_SIZE", "10"))  # Max keep-alive connections to RocketChat
+CONNECT_TIMEOUT = float(os.environ.get("RC_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("RC_READ_TIMEOUT", "15"))
+MAX_RATE_LIMIT_RETRIES = int(os.environ.get("RC_MAX_RATE_LIMIT_RETRIES", "3"))
+MAX_RATE_LIMIT_WAIT = float(os.environ.get("RC_MAX_RATE_LIMIT_WAIT", "10"))  # Never sleep longer than this per retry
+WORKERS = int(os.environ.get("RC_WORKERS", "4"))  # Threads for calls submitted in the background
+
+logger = logging.getLogger(__name__)
+
+
+class RocketChatClient:
+    """
+    Thin RocketChat REST client backed by one pooled keep-alive session.
+
+    Every call shares the same connection pool, so consecutive messages for one
+    request reuse an open TLS connection instead of paying a new handshake.
+    HTTP 429 responses are retried after the delay RocketChat asks for through
+    its Retry-After / X-RateLimit-Reset headers.
+    """
+
+    def __init__(self, base_url=RC_BASE_URL, headers=None, pool_size=POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_workers=WORKERS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        # only connection failures are retried by urllib3; a postMessage that
+        # reached the server must not be replayed or the student sees it twice
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2,
+                      allowed_methods=frozenset(["GET", "POST"]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers if headers is not None else HEADERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rocketchat")
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    def _rate_limit_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RATE_LIMIT_WAIT)
+            except ValueError:
+                pass
+
+        # RocketChat reports the window reset as epoch milliseconds
+        reset = response.headers.get("X-RateLimit-Reset")
+        if reset:
+            try:
+                return min(max(int(reset) / 1000.0 - time.time(), 0.0), MAX_RATE_LIMIT_WAIT)
+            except ValueError:
+                pass
+
+        return min(0.5 * (2 ** attempt), MAX_RATE_LIMIT_WAIT)
+
+    def request(self, method, api_method, payload=None):
+        """
+        Call a RocketChat REST method, retrying while rate limited.
+
+        Args:
+            method (str): HTTP verb, e.g. "POST"
+            api_method (str): REST method name, e.g. "chat.postMessage"
+            payload (dict): JSON body
+
+        Returns:
+            requests.Response: the final response (may still be a 429 after the retry budget)
+        """
+        with stage_timer(f"rocketchat.{api_method}"):
+            return self._request(method, api_method, payload)
+
+    def _request(self, method, api_method, payload):
+        url = f"{self.base_url}/{api_method}"
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            with self._stats_lock:
+                self.stats["requests"] += 1
+            try:
+                response = self.session.request(method, url, json=payload, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                raise
+
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                return response
+
+            with self._stats_lock:
+                self.stats["rate_limited"] += 1
+            delay = self._rate_limit_delay(response, attempt)
+            logger.warning(f"RocketChat rate limited {api_method}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+        return response
+
+    def post_message(self, payload):
+        """
+        Send chat.postMessage with the given payload.
+        """
+        return self.request("POST", "chat.postMessage", payload)
+
+    def update_message(self, room_id, msg_id, text):
+        """
+        Replace the text of an existing message with chat.update.
+        """
+        return self.request("POST", "chat.update", {
+            "roomId": room_id,
+            "msgId": msg_id,
+            "text": text
+        })
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run a call on the client's worker threads so independent calls can overlap.
+
+        Returns:
+            concurrent.futures.Future: resolves to the callable's result
+        """
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def get_stats(self):
+        """
+        Report request counters and connection pool usage for monitoring.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+
+        pools = []
+        for adapter in set(self.session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests_served": pool.num_requests,
+                    "idle_connections": pool.pool.qsize() if pool.pool else 0
+                })
+        stats["pools"] = pools
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_rocketchat_client():
+    """
+    Return the process-wide RocketChat client.
+
+    Returns:
+        RocketChatClient: shared client with a pooled session
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RocketChatClient()
+    return _client
+
+
+def close_rocketchat_client():
+    """
+    Close the shared RocketChat client - should only be called when the application shuts down.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
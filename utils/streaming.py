@@ -0,0 +1,116 @@
+# utils/streaming.py
+import logging
+import os
+import threading
+import time
+
+from utils.llm_json import IncrementalReplyParser
+
+logger = logging.getLogger(__name__)
+
+UPDATE_EVERY_TOKENS = int(os.environ.get("STREAM_UPDATE_EVERY_TOKENS", "20"))
+UPDATE_EVERY_MS = int(os.environ.get("STREAM_UPDATE_EVERY_MS", "700"))
+
+def partial_response_text(buffer):
+    """
+    Extract the (possibly unfinished) value of the "response" field from a
+    partially streamed JSON reply.
+
+    Returns:
+        str: the text generated for "response" so far, or "" if it has not started
+    """
+    parser = IncrementalReplyParser()
+    parser.feed(buffer)
+    return parser.partial_text("response")
+
+
+class ProgressiveMessageUpdater:
+    """
+    Edits a RocketChat message with chat.update as a streamed answer grows.
+
+    Updates are throttled to one per `every_tokens` chunks or `every_ms`
+    milliseconds, whichever comes first. They are sent from the RocketChat
+    client's worker threads so consuming the stream never waits on the chat
+    server; at most one update is in flight and an in-flight update is never
+    queued behind, so the message only ever moves forward.
+    """
+
+    def __init__(self, client, room_id, msg_id, render=partial_response_text,
+                 every_tokens=UPDATE_EVERY_TOKENS, every_ms=UPDATE_EVERY_MS,
+                 prefix=" :everything_fine_parrot: ", suffix=" ..."):
+        self.client = client
+        self.room_id = room_id
+        self.msg_id = msg_id
+        self.render = render
+        self.every_tokens = every_tokens
+        self.every_ms = every_ms
+        self.prefix = prefix
+        self.suffix = suffix
+
+        self._chunks = []
+        self._tokens_since_update = 0
+        self._last_update = time.monotonic()
+        self._last_text = ""
+        self._in_flight = None
+        self._lock = threading.Lock()
+        self.updates_sent = 0
+        self.first_update_at = None
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """
+        Add a streamed chunk; sends an update when the throttle allows.
+        """
+        self._chunks.append(chunk)
+        self._tokens_since_update += 1
+        elapsed_ms = (time.monotonic() - self._last_update) * 1000
+        if self._tokens_since_update >= self.every_tokens or elapsed_ms >= self.every_ms:
+            self._maybe_update()
+
+    def _maybe_update(self):
+        with self._lock:
+            if self._in_flight is not None and not self._in_flight.done():
+                return
+
+            rendered = self.render(self.text)
+            if not rendered or rendered == self._last_text:
+                return
+
+            self._last_text = rendered
+            self._tokens_since_update = 0
+            self._last_update = time.monotonic()
+            if self.first_update_at is None:
+                self.first_update_at = self._last_update
+            self.updates_sent += 1
+            self._in_flight = self.client.submit(
+                self.client.update_message, self.room_id, self.msg_id, self.prefix + rendered + self.suffix
+            )
+
+    def stream(self, chunks, timeout=5):
+        """
+        Feed every chunk of a stream, then wait for the last update.
+
+        Returns:
+            str: the full streamed text
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.finish(timeout)
+
+    def finish(self, timeout=5):
+        """
+        Wait for the last in-flight update so a later final edit cannot be overtaken.
+
+        Returns:
+            str: the full streamed text
+        """
+        in_flight = self._in_flight
+        if in_flight is not None:
+            try:
+                in_flight.result(timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Progressive update failed: {str(e)}")
+        return self.text
@@ -0,0 +1,92 @@
+# utils/task_queue.py
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds its maximum number of pending tasks."""
+
+
+class KeyedWorkQueue:
+    """
+    Thread pool that runs tasks sharing a key strictly in submission order.
+
+    Tasks for different keys run concurrently on the pool; tasks for the same
+    key (e.g. one student's user_id) are drained one at a time by a single
+    worker, so two messages from the same student are never answered out of
+    order. Ordering is per process: each gunicorn worker has its own queue.
+    """
+
+    def __init__(self, max_workers=8, max_pending=1000, name="worker"):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queues = {}  # key -> deque of tasks not yet started
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Enqueue fn(*args, **kwargs) behind any earlier task with the same key.
+
+        Raises:
+            QueueFullError: if max_pending tasks are already waiting or running
+        """
+        task = (fn, args, kwargs)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"{self._pending} tasks already pending")
+            self._pending += 1
+
+            queue = self._queues.get(key)
+            if queue is not None:
+                # a worker is already draining this key and will pick it up
+                queue.append(task)
+                return
+            self._queues[key] = deque([task])
+
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                fn, args, kwargs = queue.popleft()
+
+            try:
+                fn(*args, **kwargs)
+                failed = False
+            except Exception:
+                logger.exception(f"Background task for key {key} failed")
+                failed = True
+
+            with self._lock:
+                self._pending -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    def get_stats(self):
+        """
+        Report queue depth and task counters for monitoring.
+        """
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "active_keys": len(self._queues),
+                "completed": self._completed,
+                "failed": self._failed,
+                "max_pending": self.max_pending
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,261 @@
+# utils/text_store.py
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+
+from utils.corpus import file_sha256
+from utils.uploads import HANDBOOK_REFERENCES, RESOURCES_DIR
+
+logger = logging.getLogger(__name__)
+
+TEXT_STORE_DIR = os.environ.get("HANDBOOK_TEXT_DIR", os.path.join(RESOURCES_DIR, "index", "text"))
+STORE_FORMAT = 1  # Bump when extraction or the artifact layout changes
+PAGE_SEPARATOR = b"\f"  # Between pages in the .txt artifact, so it also reads fine as plain text
+
+
+def extract_pages(path):
+    """
+    Return the plain text of every page of a PDF, in page order.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        text = (page.extract_text() or "").replace("\ufffd", " ")
+        pages.append(" ".join(text.split()))
+    return pages
+
+
+class HandbookText:
+    """
+    Read-only, memory-mapped view of one extracted handbook.
+
+    The manifest holds the byte offsets of every page, so a page or any
+    byte range is sliced straight out of the page cache: nothing is parsed
+    and nothing is read until it is used. All workers share the same pages.
+    """
+
+    def __init__(self, text_path, manifest):
+        self.manifest = manifest
+        self.source = manifest["source"]
+        self.sha256 = manifest["sha256"]
+        self._pages = manifest["pages"]
+        with open(text_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # an empty file cannot be mapped
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @property
+    def page_count(self):
+        return len(self._pages)
+
+    def page_bytes(self, page):
+        """
+        Return a zero-copy memoryview of a 1-based page's UTF-8 text.
+        """
+        entry = self._pages[page - 1]
+        return memoryview(self._buffer)[entry["start"]:entry["end"]]
+
+    def page(self, page):
+        """
+        Return the text of a 1-based page.
+        """
+        return str(self.page_bytes(page), "utf-8")
+
+    def pages(self, first=1, last=None):
+        """
+        Yield (page number, text) for a range of pages, inclusive.
+        """
+        last = self.page_count if last is None else min(last, self.page_count)
+        for page in range(first, last + 1):
+            yield page, self.page(page)
+
+    def slice(self, start, end):
+        """
+        Return the text between two byte offsets, e.g. a section that spans pages.
+        """
+        return str(memoryview(self._buffer)[start:end], "utf-8", errors="ignore")
+
+    def upload_text(self):
+        """
+        Return the whole handbook as text with a page marker before each page,
+        so chunks retrieved from an LLMProxy session still carry their page.
+        """
+        return "\n\n".join(f"[{self.source}, page {page}]\n{text}" for page, text in self.pages() if text)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+class TextStore:
+    """
+    Page-indexed text artifacts for the handbook PDFs.
+
+    For each PDF the build step writes the extracted pages into one UTF-8
+    .txt file and a JSON manifest with the source hash and, per page, its
+    byte offsets and content hash. Artifacts are keyed by the PDF's SHA-256,
+    so a rebuild only re-extracts files that changed. The manifest is
+    written last and names its .txt file, so workers never see an artifact
+    that is only half written.
+    """
+
+    def __init__(self, references=HANDBOOK_REFERENCES, resources_dir=RESOURCES_DIR, store_dir=TEXT_STORE_DIR):
+        self.references = list(references)
+        self.resources_dir = resources_dir
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        self._open = {}  # reference -> (HandbookText, manifest mtime)
+
+    def _manifest_path(self, reference):
+        return os.path.join(self.store_dir, f"{reference}.json")
+
+    def read_manifest(self, reference):
+        """
+        Return the manifest of a built artifact, or None if there is none.
+        """
+        try:
+            with open(self._manifest_path(reference), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get("format") == STORE_FORMAT else None
+
+    def _write(self, reference, sha256):
+        pages = extract_pages(os.path.join(self.resources_dir, reference))
+
+        entries = []
+        offset = 0
+        encoded = []
+        for number, text in enumerate(pages, 1):
+            data = text.encode("utf-8")
+            if number > 1:
+                offset += len(PAGE_SEPARATOR)
+            entries.append({
+                "page": number,
+                "start": offset,
+                "end": offset + len(data),
+                "sha256": hashlib.sha256(data).hexdigest()
+            })
+            encoded.append(data)
+            offset += len(data)
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        text_file = f"{reference}.{sha256[:16]}.txt"
+        text_path = os.path.join(self.store_dir, text_file)
+        tmp_path = f"{text_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PAGE_SEPARATOR.join(encoded))
+        os.replace(tmp_path, text_path)
+
+        manifest = {
+            "format": STORE_FORMAT,
+            "source": reference,
+            "sha256": sha256,
+            "text_file": text_file,
+            "bytes": offset,
+            "source_bytes": os.path.getsize(os.path.join(self.resources_dir, reference)),
+            "pages": entries
+        }
+        manifest_path = self._manifest_path(reference)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+        # drop text files of earlier versions; open maps keep their own copy alive
+        for name in os.listdir(self.store_dir):
+            if name.startswith(f"{reference}.") and name.endswith(".txt") and name != text_file:
+                os.remove(os.path.join(self.store_dir, name))
+        return manifest
+
+    def build(self, references=None, force=False):
+        """
+        Extract every PDF whose artifact is missing or was built from other contents.
+
+        Returns:
+            dict: {"built": [...], "unchanged": [...]} reference names
+        """
+        summary = {"built": [], "unchanged": []}
+        for reference in references or self.references:
+            sha256 = file_sha256(os.path.join(self.resources_dir, reference))
+            manifest = self.read_manifest(reference)
+            if not force and manifest is not None and manifest["sha256"] == sha256:
+                summary["unchanged"].append(reference)
+                continue
+            self._write(reference, sha256)
+            summary["built"].append(reference)
+            logger.info(f"extracted {reference} into the handbook text store")
+        return summary
+
+    def open(self, reference):
+        """
+        Return the memory-mapped text of a handbook, building it first if needed.
+
+        The mapping is cached per process; a stat of the manifest tells when a
+        rebuild (by this or another worker) has replaced the artifact.
+        """
+        manifest_path = self._manifest_path(reference)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            cached = self._open.get(reference)
+            if cached is not None and cached[1] == mtime:
+                return cached[0]
+
+        manifest = self.read_manifest(reference)
+        if manifest is None:
+            self.build([reference])
+            manifest = self.read_manifest(reference)
+        mtime = os.stat(manifest_path).st_mtime_ns
+
+        handbook = HandbookText(os.path.join(self.store_dir, manifest["text_file"]), manifest)
+        with self._lock:
+            self._open[reference] = (handbook, mtime)
+        return handbook
+
+    def get_state(self):
+        """
+        Report, per handbook, the built artifact's hash, page count and size.
+        """
+        state = {}
+        for reference in self.references:
+            manifest = self.read_manifest(reference)
+            state[reference] = None if manifest is None else {
+                "sha256": manifest["sha256"],
+                "pages": len(manifest["pages"]),
+                "bytes": manifest["bytes"],
+                "source_bytes": manifest["source_bytes"]
+            }
+        return state
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_text_store():
+    """
+    Return the process-wide handbook text store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TextStore()
+    return _store
+
+
+if __name__ == "__main__":
+    # python -m utils.text_store [--force]: (re)build the text artifacts, e.g. during deployment
+    import sys
+
+    store = get_text_store()
+    print(json.dumps(store.build(force="--force" in sys.argv), indent=2))
+    print(json.dumps(store.get_state(), indent=2))
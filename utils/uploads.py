@@ -1,16 +1,44 @@
-from llmproxy import pdf_upload
-
-def handbook_upload(user_id):
-    try:
-        all_references = ["cs_handbook.pdf", "soe-grad-handbook.pdf", "filtered_grad_courses.pdf"]
-        for reference in all_references:
-            response = pdf_upload(
-                path = f'resources/{reference}',
-                session_id = 'cs-advising-handbooks-v5-' + user_id,
-                strategy = 'smart'
-            )
-            print("✅ " + reference + " is successfully loaded")
-
-    except Exception as e:
-        print(f"❌ Error uploading handbooks: {str(e)}")
+import logging
+import os
 
+from llmproxy import pdf_upload, text_upload
+
+logger = logging.getLogger(__name__)
+
+# handbooks that make up the advising RAG corpus
+HANDBOOK_REFERENCES = ["cs_handbook.pdf", "soe-grad-handbook.pdf", "filtered_grad_courses.pdf"]
+RESOURCES_DIR = "resources"
+HANDBOOK_UPLOAD_FORMAT = os.environ.get("HANDBOOK_UPLOAD_FORMAT", "pdf")  # "pdf" or "text" (pre-extracted, page-marked)
+
+def reference_upload(reference, session_id):
+    """
+    Upload one handbook from resources/ into an LLMProxy session.
+
+    With HANDBOOK_UPLOAD_FORMAT=text the pre-extracted text from the text
+    store is sent instead of the PDF, which is a fraction of the size.
+
+    Returns:
+        bool: True if the proxy accepted the upload
+    """
+    if HANDBOOK_UPLOAD_FORMAT == "text":
+        # imported here: the text store itself depends on this module
+        from utils.text_store import get_text_store
+
+        response = text_upload(
+            text = get_text_store().open(reference).upload_text(),
+            session_id = session_id,
+            strategy = 'smart',
+            description = reference
+        )
+    else:
+        response = pdf_upload(
+            path = f'{RESOURCES_DIR}/{reference}',
+            session_id = session_id,
+            strategy = 'smart'
+        )
+    if response.startswith("Successfully"):
+        logger.info("✅ %s is successfully loaded", reference)
+        return True
+
+    logger.error("❌ Error uploading %s: %s", reference, response)
+    return False